@@ -4,6 +4,9 @@ import random
 F = open('wordlist.txt')
 words = F.readlines()
 F.close()
+anagrams = {}                               # sorted letters -> every word spelt with them
+for line in words:
+    anagrams.setdefault(''.join(sorted(line.rstrip())), set()).add(line.rstrip())
 while True:
     word = words[random.randrange(len(words))]
     while len(word) > 5 or len(word) == 0:
@@ -15,8 +18,7 @@ while True:
         print(word.pop(random.randrange(len(word))), end = ' ')
     print('\nType your answer')
     match_word = input()
-    new_word = match_word + '\n'
-    if new_word in words and set(match_word) == set(old_word):
+    if match_word in anagrams.get(''.join(sorted(old_word)), ()):
             print('You win.')
     else:
         print('The answer is ' + old_word)
@@ -5,11 +5,30 @@ Professor: Dr Bing Wang
 Assignment 1: HTTP Client
 """
 
-from sys import argv, exit
+from os import makedirs, remove, replace
+from os.path import dirname, join, normpath
+from sys import argv, exit, stdout
 from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from time import perf_counter, sleep
+from _thread import start_new_thread, allocate_lock, get_ident
+from urllib.parse import urlsplit
 
 DEFAULT_PORT = 80
 CRLF = '\r\n'
+BUFFER_SIZE = 256 * 1024  # Bytes preallocated for receiving a download.
+RECV_BUFFER_SIZE = 65536  # Bytes preallocated per benchmark connection.
+NO_BODY_STATUSES = [204, 304]  # Along with every 1xx, responses that never have a body.
+DEFAULT_OPTIONS = {
+    'output': '',  # File to save the response body to, rather than printing it.
+    'batch': '',  # File listing further objects/URLs to fetch, one per line.
+    'directory': '.',  # Directory fetched objects are saved under in batch mode.
+    'parallel': 4,  # Most objects fetched at once in batch mode.
+    'requests': 0,  # Total requests to make in benchmark mode, 0 makes a single request.
+    'connections': 1,  # Concurrent keep-alive connections used in benchmark mode.
+    'rate': 0.0,  # Target requests per second across all connections, 0 for as fast as possible.
+    'timeout': 10.0,  # Seconds to wait on a connection before counting an error.
+}
+PERCENTILES = [50, 90, 99, 99.9]
 
 
 class BasicHTTPClient(object):
@@ -19,9 +38,12 @@ class BasicHTTPClient(object):
     arguments.
     """
     def __init__(self):
+        self.options = self.parse_options()
         self.host, self.obj, self.port, self.headers = self.parse_arguments()
         self.request = self.construct_request()
-        self.sock = self.initiate_connection()
+        self.objects = self.list_objects()  # Every object to fetch (more than one in batch mode).
+        batch = len(self.objects) > 1
+        self.sock = None if self.options['requests'] or batch else self.initiate_connection()
 
     def parse_arguments(self):
         """
@@ -30,6 +52,7 @@ class BasicHTTPClient(object):
         :return: a tuple including the host (string), object (string), port (int) and headers
          [(string, string), ...]
         """
+        argv = self.arguments  # Positional arguments only, see parse_options.
         if len(argv) < 3:
             self.print_usage_message('Incorrect number of arguments!')
             exit(1)
@@ -51,7 +74,7 @@ class BasicHTTPClient(object):
         else:  # Headers not provided first, so get port.
             try:
                 port = int(argv[3])  # Accept any port for client
-            except TypeError:
+            except ValueError:
                 print('Client startup failed!\n'
                       'Port provided was not an integer!')
                 exit(3)
@@ -66,6 +89,49 @@ class BasicHTTPClient(object):
                 exit(4)
         return host, obj, port, headers
 
+    def parse_options(self):
+        """
+        Separates optional --name=value arguments (which may appear anywhere) from the
+        positional ones, which are left in self.arguments for parse_arguments.
+        N.B. Will exit the process if an option is unknown or its value is invalid.
+        :return: a dictionary mapping option names (string) to values (int or float).
+        """
+        options = dict(DEFAULT_OPTIONS)
+        self.arguments = [argument for argument in argv if not argument.startswith('--')]
+        for argument in argv[1:]:
+            if not argument.startswith('--'):
+                continue
+            name, _, value = argument[2:].partition('=')
+            try:
+                if name not in options:
+                    raise ValueError(name)
+                options[name] = type(DEFAULT_OPTIONS[name])(value)
+                if not isinstance(options[name], str) and options[name] < 0:
+                    raise ValueError(value)
+            except ValueError:
+                self.print_usage_message('Invalid option: ' + argument)
+                exit(5)
+        options['connections'] = max(options['connections'], 1)
+        return options
+
+    def list_objects(self):
+        """
+        Lists the objects to fetch: the (comma separated) object argument followed by each
+        line of the --batch file, if given. Entries may be paths on the host being connected
+        to or full http:// URLs.
+        N.B. Will exit the process if the batch file cannot be read.
+        :return: [string, ...] list of objects/URLs.
+        """
+        objects = [obj for obj in self.obj.split(',') if obj]
+        if self.options['batch']:
+            try:
+                with open(self.options['batch']) as file:
+                    objects += [line.strip() for line in file if line.strip()]
+            except OSError:
+                self.print_usage_message('Could not read batch file!')
+                exit(6)
+        return objects
+
     def print_usage_message(self, message_header):
         """
         Prints a custom error message to the terminal based on a provided specific message
@@ -74,18 +140,26 @@ class BasicHTTPClient(object):
         :return: None
         """
         base_message = 'Client startup failed!\n' \
-                       'Usage: python3 http-client.py <source> <object> [port] [headers...]\n' \
+                       'Usage: python3 http-client.py <source> <object> [port] [headers...] [options...]\n' \
                        'N.B: Headers must be provided in the form HeaderName:HeaderValue\n' \
                        '(space separated, but not between Name and Value).'
         print(message_header + '\n' + base_message)
 
-    def construct_request(self):
+    def construct_request(self, keep_alive=False, obj=None, host=None):
         """
         Constructs a properly formatted HTTP request based on the object and headers specified
         in the command-line arguments.
+        :param keep_alive: if True, a HTTP/1.1 request is made so the connection can be reused.
+        :param obj: the object to request, if not the one given on the command line.
+        :param host: the host the request is for, if not the one given on the command line.
         :return: a string representation of the HTTP request.
         """
-        request = 'GET %s HTTP/1.0%s' % (self.obj if self.obj[0] == '/' else '/' + self.obj, CRLF)
+        obj = obj or self.obj
+        obj = obj if obj[0] == '/' else '/' + obj
+        if keep_alive:
+            request = 'GET %s HTTP/1.1%sHost: %s%s' % (obj, CRLF, host or self.host, CRLF)
+        else:
+            request = 'GET %s HTTP/1.0%s' % (obj, CRLF)
         for (header, value) in self.headers:  # Add all headers to request
             request += header + ': ' + value + CRLF
         request += CRLF
@@ -108,21 +182,530 @@ class BasicHTTPClient(object):
     def make_request(self):
         """
         Given a connected socket, make the HTTP request given by construct_request to the
-        socket given by initiate_connection.
-        :return:
+        socket given by initiate_connection. The response header is printed and the body is
+        streamed, unaltered, to the --output file if one was given or to standard output.
+        :return: None
+        """
+        self.sock.sendall(self.request.encode('utf-8'))  # Send request
+        reader = ResponseReader(self.sock)
+        try:
+            response = reader.read_head()
+            print(response.head + CRLF, flush=True)
+            if self.options['output']:
+                with open(self.options['output'], 'wb') as file:
+                    length = reader.read_body(response, file.write)
+                print('Saved {} bytes to {}'.format(length, self.options['output']))
+            else:
+                reader.read_body(response, stdout.buffer.write)
+                stdout.buffer.flush()
+        except (EOFError, ValueError) as error:
+            print('Invalid response from server: {}'.format(error))
+            exit(8)
+        finally:
+            self.sock.close()  # Clean up/close socket.
+
+
+class LoadGenerator(object):
+    """
+    Benchmarks a server by repeatedly requesting a client's object over several concurrent
+    keep-alive connections, optionally at a target rate, and reports throughput, latency
+    percentiles and errors.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.request = client.construct_request(keep_alive=True).encode('utf-8')
+        self.total = client.options['requests']
+        self.rate = client.options['rate']
+        self.lock = allocate_lock()
+        self.issued = 0  # Requests handed out to connections so far.
+        self.finished = 0  # Connections that have stopped.
+        self.latencies = []  # Seconds, one per successful request.
+        self.received = 0  # Bytes of response bodies received.
+        self.errors = {'connect': 0, 'read': 0, 'status': 0}
+        self.start = 0.0
+
+    def run(self):
+        """
+        Runs the benchmark to completion and prints the report.
+        :return: None
+        """
+        connections = min(self.client.options['connections'], self.total)
+        print('Benchmarking {}:{}{} with {} requests over {} connections{}...'.format(
+            self.client.host, self.client.port, self.client.obj, self.total, connections,
+            ' at {:g} req/s'.format(self.rate) if self.rate else ''))
+        self.start = perf_counter()
+        for _ in range(connections):
+            start_new_thread(self.run_connection, ())
+        while self.finished < connections:
+            sleep(0.05)
+        self.report(perf_counter() - self.start)
+
+    def next_request(self):
+        """
+        Claims the next request to make.
+        :return: the time (perf_counter) the request is scheduled for, or None if all have been
+        issued.
+        """
+        with self.lock:
+            if self.issued == self.total:
+                return None
+            index = self.issued
+            self.issued += 1
+        return self.start + index / self.rate if self.rate else perf_counter()
+
+    def run_connection(self):
+        """
+        Body of each connection thread: makes requests over one keep-alive connection
+        (reconnecting whenever it is closed) until all requests have been issued.
+        :return: None
+        """
+        sock, reader = None, None
+        latencies, received, errors = [], 0, dict.fromkeys(self.errors, 0)
+        try:
+            while True:
+                scheduled = self.next_request()
+                if scheduled is None:
+                    break
+                delay = scheduled - perf_counter()
+                if delay > 0:  # Ahead of the target rate.
+                    sleep(delay)
+                if sock is None:
+                    sock = socket(AF_INET, SOCK_STREAM)
+                    sock.settimeout(self.client.options['timeout'])
+                    try:
+                        sock.connect((self.client.host, self.client.port))
+                    except OSError:
+                        errors['connect'] += 1
+                        sock.close()
+                        sock = None
+                        continue
+                    reader = ResponseReader(sock, RECV_BUFFER_SIZE)
+                try:
+                    sock.sendall(self.request)
+                    response = reader.read_head()
+                    length = reader.read_body(response, discard)
+                except (OSError, ValueError, EOFError):  # Includes timeouts and resets.
+                    errors['read'] += 1
+                    sock.close()
+                    sock = None
+                    continue
+                # Latency is measured from the scheduled time, so a slow server is not hidden by
+                # requests queueing up behind it (coordinated omission).
+                latencies.append(perf_counter() - scheduled)
+                received += length
+                if response.status >= 400:
+                    errors['status'] += 1
+                if response.headers.get('connection', '').lower() == 'close':
+                    sock.close()
+                    sock = None
+        finally:
+            if sock is not None:
+                sock.close()
+            with self.lock:
+                self.latencies += latencies
+                self.received += received
+                for kind in errors:
+                    self.errors[kind] += errors[kind]
+                self.finished += 1
+
+    def report(self, elapsed):
+        """
+        Prints the throughput, error counts, latency percentiles and a latency histogram.
+        :param elapsed: the duration of the benchmark in seconds.
+        :return: None
+        """
+        latencies = sorted(self.latencies)
+        print('Completed {} requests in {:.3f}s: {:.1f} req/s, {:.2f} MB/s'.format(
+            len(latencies), elapsed, len(latencies) / elapsed, self.received / elapsed / 1e6))
+        print('Errors: {} (connect {connect}, read {read}, status {status})'.format(
+            sum(self.errors.values()), **self.errors))
+        if not latencies:
+            return
+        print('Latency (ms): min {:.3f}, mean {:.3f}, max {:.3f}'.format(
+            latencies[0] * 1e3, sum(latencies) / len(latencies) * 1e3, latencies[-1] * 1e3))
+        print('  ' + ', '.join('p{:g} {:.3f}'.format(percentile, 1e3 * latencies[
+            min(int(len(latencies) * percentile / 100), len(latencies) - 1)])
+            for percentile in PERCENTILES))
+        print('Histogram (ms):')
+        bound, index = 0.1, 0  # Upper bound (ms) of each bucket doubles.
+        while index < len(latencies):
+            count = 0
+            while index < len(latencies) and latencies[index] * 1e3 <= bound:
+                count += 1
+                index += 1
+            if count:
+                print('  <= {:>10.1f} {:>8} {}'.format(
+                    bound, count, '#' * max(1, 50 * count // len(latencies))))
+            bound *= 2
+
+
+class Response(object):
+    """
+    The status line and headers of a response read by a ResponseReader.
+    """
+    __slots__ = ('status', 'reason', 'headers', 'head')
+
+    def __init__(self, status, reason, headers, head):
+        self.status = status  # Status code, e.g. 200.
+        self.reason = reason  # Reason phrase, e.g. 'OK'.
+        self.headers = headers  # {lower case name: value}
+        self.head = head  # The status line and headers as received (string).
+
+
+class ResponseReader(object):
+    """
+    Reads HTTP responses from a connection into a single preallocated buffer with recv_into,
+    so a response body of any size is streamed to a sink in large pieces without allocating
+    (or decoding) per chunk. Bytes received beyond the end of one response are kept for the
+    next, so a reader can be reused on a keep-alive connection.
+    """
+    def __init__(self, sock, size=BUFFER_SIZE):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Unread data is buffer[start:end].
+        self.end = 0
+
+    def fill(self):
+        """
+        Receives more data into the buffer after any unread data, moving the unread data to
+        the front of the buffer first if needed.
+        N.B. Raises ValueError if the buffer is full of unread data.
+        :return: the number of bytes received, 0 if the connection has been closed.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            if self.start == 0:
+                raise ValueError('Response line or header too large')
+            unread = self.end - self.start
+            self.buffer[:unread] = self.view[self.start:self.end]
+            self.start, self.end = 0, unread
+        received = self.sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def read_line(self):
+        """
+        Reads a single CRLF terminated line.
+        N.B. Raises EOFError if the connection closes first.
+        :return: the line, without the CRLF, as a string.
+        """
+        while True:
+            index = self.buffer.find(b'\r\n', self.start, self.end)
+            if index != -1:
+                line = bytes(self.view[self.start:index]).decode('latin-1')
+                self.start = index + 2
+                return line
+            if not self.fill():
+                raise EOFError('Connection closed mid line')
+
+    def read_head(self):
+        """
+        Reads the status line and headers of the next response.
+        N.B. Raises EOFError if the connection closes first and ValueError if the status line
+        is malformed.
+        :return: a Response.
+        """
+        while True:
+            index = self.buffer.find(b'\r\n\r\n', self.start, self.end)
+            if index != -1:
+                break
+            if not self.fill():
+                raise EOFError('Connection closed before response header')
+        head = bytes(self.view[self.start:index]).decode('latin-1')
+        self.start = index + 4
+        lines = head.split(CRLF)
+        parts = lines[0].split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise ValueError('Malformed status line: ' + lines[0])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            headers[name] = headers[name] + ', ' + value.strip() if name in headers else \
+                value.strip()
+        return Response(int(parts[1]), parts[2] if len(parts) == 3 else '', headers, head)
+
+    def read_body(self, response, sink, head_request=False):
         """
-        self.sock.send(self.request.encode('utf-8'))  # Send request
-        while True:  # Loop through until there is no more data, printing as it is received.
-            data = self.sock.recv(1024).decode()
-            if data == '':
+        Reads the body of a response, framed by chunked transfer coding, Content-Length or the
+        connection closing, passing it to sink piece by piece.
+        :param response: the Response returned by read_head.
+        :param sink: function called with each piece of the body as a memoryview, which is only
+        valid until the function returns (e.g. file.write).
+        :param head_request: True if the response is to a HEAD request (so has no body).
+        :return: the length of the body in bytes.
+        """
+        if head_request or response.status < 200 or response.status in NO_BODY_STATUSES:
+            return 0
+        if 'chunked' in response.headers.get('transfer-encoding', '').lower():
+            length = 0
+            while True:
+                size = int(self.read_line().split(';')[0], 16)  # Ignore chunk extensions.
+                if size == 0:
+                    while self.read_line():  # Skip trailers up to the blank line.
+                        pass
+                    return length
+                self.stream(size, sink)
+                length += size
+                if self.read_line():
+                    raise ValueError('Chunk not terminated by CRLF')
+        if 'content-length' in response.headers:
+            length = int(response.headers['content-length'])
+            self.stream(length, sink)
+            return length
+        return self.stream(None, sink)  # Body ends when the connection closes.
+
+    def stream(self, count, sink):
+        """
+        Passes the next count bytes (or everything until the connection closes) to sink,
+        directly from the buffer.
+        N.B. Raises EOFError if the connection closes before count bytes are read.
+        :param count: the number of bytes to read, or None to read until the connection closes.
+        :param sink: function called with each piece of data as a memoryview.
+        :return: the number of bytes read.
+        """
+        remaining = count
+        total = 0
+        while remaining is None or remaining > 0:
+            if self.start == self.end and not self.fill():
+                if remaining is None:
+                    return total
+                raise EOFError('Connection closed mid body')
+            size = self.end - self.start if remaining is None else \
+                min(self.end - self.start, remaining)
+            sink(self.view[self.start:self.start + size])
+            self.start += size
+            total += size
+            if remaining is not None:
+                remaining -= size
+        return total
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of idle keep-alive connections (each with its ResponseReader), kept
+    per host and port so that many requests share a few TCP handshakes.
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout  # Socket timeout (seconds) for new connections.
+        self.idle = {}  # (host, port) -> [(sock, reader), ...]
+        self.lock = allocate_lock()
+        self.opened = 0  # Connections created over the pool's lifetime.
+
+    def acquire(self, host, port):
+        """
+        Takes an idle connection to a host, or opens a new one if there is none.
+        N.B. Raises OSError if a new connection cannot be made.
+        :param host: the host to connect to.
+        :param port: the port to connect to.
+        :return: a tuple of the socket, its ResponseReader and whether it was reused (bool).
+        """
+        with self.lock:
+            connections = self.idle.get((host, port))
+            if connections:
+                sock, reader = connections.pop()
+                return sock, reader, True
+            self.opened += 1
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect((host, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock, ResponseReader(sock, RECV_BUFFER_SIZE), False
+
+    def release(self, host, port, sock, reader):
+        """
+        Returns a connection whose response has been fully read to the pool for reuse.
+        :param host: the host the connection is to.
+        :param port: the port the connection is to.
+        :param sock: the connected socket.
+        :param reader: the socket's ResponseReader.
+        :return: None
+        """
+        with self.lock:
+            self.idle.setdefault((host, port), []).append((sock, reader))
+
+    def close_all(self):
+        """
+        Closes every idle connection.
+        :return: None
+        """
+        with self.lock:
+            for connections in self.idle.values():
+                for sock, _ in connections:
+                    sock.close()
+            self.idle = {}
+
+
+class BatchFetcher(object):
+    """
+    Fetches a list of objects/URLs concurrently (with bounded parallelism) over pooled
+    keep-alive connections, saving each body to a file mirroring its path.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.pool = ConnectionPool(client.options['timeout'])
+        self.lock = allocate_lock()
+        self.next_index = 0  # Next object in client.objects to fetch.
+        self.finished = 0  # Worker threads that have stopped.
+        self.fetched = 0  # Objects saved with a successful (2xx) status.
+        self.failed = 0
+        self.received = 0  # Bytes of response bodies saved.
+
+    def run(self):
+        """
+        Fetches every object and prints a summary.
+        :return: None
+        """
+        objects = self.client.objects
+        workers = min(self.client.options['parallel'] or 1, len(objects))
+        print('Fetching {} objects with {} parallel connections...'.format(len(objects), workers))
+        start = perf_counter()
+        for _ in range(workers):
+            start_new_thread(self.run_worker, ())
+        while self.finished < workers:
+            sleep(0.05)
+        self.pool.close_all()
+        print('Fetched {} objects ({} failed, {} bytes) in {:.3f}s over {} connections'.format(
+            self.fetched, self.failed, self.received, perf_counter() - start, self.pool.opened))
+
+    def run_worker(self):
+        """
+        Body of each worker thread: fetches objects until none are left.
+        :return: None
+        """
+        try:
+            while True:
+                with self.lock:
+                    if self.next_index == len(self.client.objects):
+                        return
+                    target = self.client.objects[self.next_index]
+                    self.next_index += 1
+                self.fetch(target)
+        finally:
+            with self.lock:
+                self.finished += 1
+
+    def locate(self, target):
+        """
+        Splits an object or URL into where to fetch it from.
+        N.B. Raises ValueError for URLs with a scheme other than http.
+        :param target: a path on the command line host, or a http:// URL.
+        :return: a tuple of the host (string), port (int) and object (string).
+        """
+        if '://' not in target:
+            return self.client.host, self.client.port, target
+        url = urlsplit(target)
+        if url.scheme != 'http':
+            raise ValueError('Unsupported scheme: ' + url.scheme)
+        obj = (url.path or '/') + ('?' + url.query if url.query else '')
+        return url.hostname, url.port or DEFAULT_PORT, obj
+
+    def output_path(self, host, obj):
+        """
+        Chooses the file an object is saved to, mirroring its path (less any query) under the
+        output directory, with a directory per host for URLs from other hosts.
+        :param host: the host the object is fetched from.
+        :param obj: the requested object.
+        :return: the file path (string).
+        """
+        path = normpath('/' + obj.split('?')[0]).lstrip('/')  # Cannot escape the directory.
+        if not path or obj.split('?')[0].endswith('/'):
+            path = join(path, 'index.html')
+        if host != self.client.host:
+            path = join(host, path)
+        return join(self.client.options['directory'], path)
+
+    def fetch(self, target):
+        """
+        Fetches a single object and saves its body, retrying once on a fresh connection if a
+        pooled one turns out to have been closed by the server. The body is written to a
+        temporary file which only replaces the object's file once it has been read in full
+        with a 2xx status, so error pages and truncated bodies are never saved.
+        :param target: a path on the command line host, or a http:// URL.
+        :return: None
+        """
+        try:
+            host, port, obj = self.locate(target)
+            request = self.client.construct_request(True, obj, host).encode('utf-8')
+            path = self.output_path(host, obj)
+            for attempt in range(2):
+                sock, reader, reused = self.pool.acquire(host, port)
+                try:
+                    sock.sendall(request)
+                    response = reader.read_head()
+                except (OSError, EOFError):
+                    sock.close()
+                    if reused and attempt == 0:  # Stale keep-alive connection, try a new one.
+                        continue
+                    raise
                 break
-            print(data, end='')
-        self.sock.close()  # Clean up/close socket.
+            makedirs(self.client.options['directory'], exist_ok=True)
+            # Unique to this worker thread, and on the same file system as path.
+            temporary = join(self.client.options['directory'], '.fetch.{}'.format(get_ident()))
+            try:
+                with open(temporary, 'wb') as file:
+                    length = reader.read_body(response, file.write)
+            except (OSError, EOFError, ValueError):
+                sock.close()
+                discard_file(temporary)
+                raise
+            if 200 <= response.status < 300:
+                makedirs(dirname(path) or '.', exist_ok=True)
+                replace(temporary, path)
+            else:
+                discard_file(temporary)
+                path = 'not saved'
+            if response.headers.get('connection', '').lower() == 'close':
+                sock.close()
+            else:
+                self.pool.release(host, port, sock, reader)
+        except (OSError, EOFError, ValueError) as error:
+            with self.lock:  # Printed under the lock so lines from workers do not interleave.
+                print('FAILED {}: {}'.format(target, error))
+                self.failed += 1
+            return
+        with self.lock:
+            print('{} {} -> {} ({} bytes)'.format(response.status, target, path, length))
+            if 200 <= response.status < 300:
+                self.fetched += 1
+            else:
+                self.failed += 1
+            self.received += length
+
+
+def discard_file(path):
+    """
+    Removes a file, if it exists.
+    :param path: the path of the file.
+    :return: None
+    """
+    try:
+        remove(path)
+    except OSError:  # Never created, or already gone.
+        pass
+
+
+def discard(data):
+    """
+    A body sink that throws the data away.
+    :param data: a piece of a response body.
+    :return: None
+    """
 
 
 if __name__ == "__main__":
     client = BasicHTTPClient()  # Instantiate client.
-    client.make_request()  # Make request.
+    if client.options['requests']:  # Benchmark mode.
+        LoadGenerator(client).run()
+    elif len(client.objects) > 1:  # Batch mode.
+        BatchFetcher(client).run()
+    else:
+        client.make_request()  # Make request.
 
 
 
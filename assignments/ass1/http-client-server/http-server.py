@@ -5,47 +5,122 @@ Professor: Dr Bing Wang
 Assignment 1: HTTP Server
 """
 
-from os.path import isdir, isfile
-from os import chdir
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from gzip import compress as gzip_compress
+from logging import getLogger
+from mimetypes import guess_type
+from mmap import mmap, ACCESS_READ
+from os.path import abspath, dirname, isdir, isfile
+import os
+from queue import Full, Queue, SimpleQueue
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
 from signal import signal, SIGINT
-from socket import gethostbyname, socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
-from sys import argv, exit
-from time import ctime, time
-from _thread import start_new_thread
+import socket as sockets
+from socket import gethostbyname, socket, socketpair, timeout, AF_INET, SOCK_STREAM, SOL_SOCKET, \
+    SO_REUSEADDR, MSG_DONTWAIT
+from struct import pack
+from sys import argv, exit, path as search_path, stdout
+from time import monotonic, perf_counter, sleep
+from traceback import print_exc
+from zlib import compress as zlib_compress
+from _thread import start_new_thread, allocate_lock
+search_path.insert(0, dirname(dirname(abspath(__file__))))  # Finds server_common (ass1).
+from server_common import AsyncLogHandler, ConnectionRegistry, Metrics, raise_file_limit, \
+    serve_metrics, shutdown_connection
 
 CRLF = '\r\n'
 DEFAULT_PORT = 50007
 DEFAULT_FILE = 'index.html'
 NOT_FOUND_FILE = 'not_found.html'
-HTML_HEADER_FORMAT = '''HTTP/1.0 {}
-Connection: close
-Content-Type: text/html
-Content-Length: {}
-
-'''
+RECV_SIZE = 16384
+ENGINES = ['thread', 'async']  # Available serving engines, first is the default.
+DEFAULT_OPTIONS = {
+    'engine': ENGINES[0],
+    'workers': 16,  # Threads serving clients in the thread engine.
+    'queue': 64,  # Accepted clients allowed to wait for a worker before being shed.
+    'backlog': 128,  # Pending (not yet accepted) connections held by the kernel.
+    'cache-size': 32 * 1024 * 1024,  # Bytes of built responses kept in memory, 0 disables.
+    'keep-alive-timeout': 5,  # Seconds an idle persistent connection is kept open.
+    'read-timeout': 10,  # Seconds a request may take to arrive in full once it has begun.
+    'write-timeout': 30,  # Seconds sending a reply may stall before the client is dropped.
+    'drain-timeout': 10,  # Seconds shutdown waits for replies in progress to finish.
+    'max-requests': 100,  # Requests served on one connection before it is closed.
+    'processes': 1,  # Server processes sharing the port, each running the chosen engine.
+    'admin-port': 0,  # Port serving /metrics to the local host, 0 to disable.
+    'log-level': 'info',  # Least severe events logged: debug (every connection), info, ...
+}
+LOG_LEVELS = ['debug', 'info', 'warning', 'error']
+DRAIN_POLL = 0.05  # Seconds between checks on connections still draining at shutdown.
+RESPAWN_DELAY = 1.0  # Seconds a worker process must survive for before it is respawned immediately.
+METHODS = ['GET', 'HEAD']  # Supported request methods.
+MAX_REQUEST_SIZE = 8192  # Most bytes of request line and headers accepted.
+OUTBOUND_LIMIT = 65536  # Pipelined replies are queued in the event loop until this much is pending.
+CACHE_REVALIDATE_INTERVAL = 1.0  # Seconds a cached response is trusted before re-checking the file.
+STREAM_THRESHOLD = 1024 * 1024  # Files larger than this (bytes) are streamed, never held in memory.
+STREAM_CHUNK = 1024 * 1024  # Most bytes handed to the kernel per sendfile/send call when streaming.
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+HTML_HEADER_FORMAT = 'HTTP/1.1 {}' + CRLF + 'Content-Type: {}' + CRLF + 'Content-Length: {}' + CRLF
+KEEP_ALIVE_HEADER = ('Connection: keep-alive' + CRLF + CRLF).encode()
+CLOSE_HEADER = ('Connection: close' + CRLF + CRLF).encode()
+HEADER_LINE_FORMAT = '{}: {}' + CRLF
+ENCODINGS = ['gzip', 'deflate']  # Supported content codings, in order of preference.
+COMPRESSIBLE_TYPES = ['application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml']  # Compressed along with every text/* type.
+COMPRESS_MIN_SIZE = 256  # Bodies smaller than this (bytes) are not worth compressing.
+COMPRESSION_LEVEL = 6
+METRICS = [  # (name, type, help) of each value exposed on the admin port.
+    ('http_connections_accepted_total', 'counter', 'Connections accepted.'),
+    ('http_connections_shed_total', 'counter', 'Connections turned away while saturated.'),
+    ('http_connections_active', 'gauge', 'Connections currently open.'),
+    ('http_requests_total', 'counter', 'Requests replied to.'),
+    ('http_response_bytes_total', 'counter', 'Bytes of responses sent, headers included.'),
+    ('http_cache_hits_total', 'counter', 'Responses served from the response cache.'),
+    ('http_cache_misses_total', 'counter', 'Responses built because they were not cached.'),
+    ('http_cache_evictions_total', 'counter', 'Responses evicted from the response cache.'),
+    ('http_cache_bytes', 'gauge', 'Bytes of responses held in the response cache.'),
+]
+LATENCY_METRIC = ('http_request_duration_seconds', 'Seconds from a request being parsed to its '
+                  'reply being sent (thread engine) or queued for sending (async engine).')
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5]  # Upper bounds (seconds) of the latency histogram buckets.
 
 
 class BasicHTTPServer(object):
     """
     Custom class defining a basic HTTP server with the ability to serve static files to
-    multiple clients concurrently (threaded).
+    multiple clients concurrently (pooled threads or a single event loop).
     """
 
     def __init__(self):
-        self.port, self.root_directory = self.parse_arguments()
-        chdir(self.root_directory)  # Change into given root directory.
+        self.port, self.root_directory, self.options = self.parse_arguments()
+        os.chdir(self.root_directory)  # Change into given root directory.
         print("Changed cwd to:" + self.root_directory)
         self.host = '127.0.0.1'  # Equivalent to localhost.
-        self.connections = []  # For keeping tract of connected clients.
+        self.registry = ConnectionRegistry()  # Open client connections, closed ones removed.
+        self.listening = None  # The listening socket served by this process.
+        self.draining = False  # True once shutdown has begun, no further requests are started.
+        self.parking = SimpleQueue()  # Idle connections handed to the idle loop by workers.
+        self.parking_wakeup = None  # Socket pair waking the idle loop when one is parked.
+        # Shared by every worker process, each reporting into its own slot.
+        self.metrics = Metrics(METRICS, LATENCY_METRIC, LATENCY_BUCKETS, self.options['processes'])
+        # Built responses by request path.
+        self.cache = ResponseCache(self.options['cache-size'], self.metrics)
+        self.worker_processes = {}  # Worker pid -> (start time, metrics slot) (supervisor only).
+        self.log_handler = AsyncLogHandler(stdout)
+        self.log = getLogger('http-server')
+        self.log.addHandler(self.log_handler)
+        self.log.setLevel(self.options['log-level'].upper())
 
     def parse_arguments(self):
         """
-        Parses the provided command line arguments and returns the port number provided.
+        Parses the provided command line arguments and returns the port number, root directory
+        and any optional --name=value settings provided.
         N.B. Will exit the process if the provided port number is not an integer.
-        :return:
+        :return: a tuple of the port (int), root directory (string) and options {string: string}.
         """
         port = DEFAULT_PORT
-        if len(argv) != 3:
+        if len(argv) < 3:
             self.print_usage_message('Incorrect number of arguments!')
             exit(5)
         try:  # Port provided, attempt to read.
@@ -60,7 +135,49 @@ class BasicHTTPServer(object):
         if not isdir(root_directory):  # If directory is invalid, exit.
             self.print_usage_message('Provided root directory is invalid!')
             exit(6)
-        return port, root_directory
+        options = self.parse_options(argv[3:])
+        if options['engine'] not in ENGINES:
+            self.print_usage_message('Unknown engine, must be one of: ' + ', '.join(ENGINES))
+            exit(7)
+        for name in ['workers', 'queue', 'backlog', 'keep-alive-timeout', 'read-timeout',
+                     'write-timeout', 'drain-timeout', 'max-requests', 'processes']:
+            if options[name] < 1:
+                self.print_usage_message('Option --{} must be at least 1!'.format(name))
+                exit(9)
+        if options['cache-size'] < 0:
+            self.print_usage_message('Option --cache-size must not be negative!')
+            exit(9)
+        if not 0 <= options['admin-port'] < 65536:
+            self.print_usage_message('Option --admin-port must be a port number, or 0!')
+            exit(9)
+        if options['log-level'] not in LOG_LEVELS:
+            self.print_usage_message('Unknown log level, must be one of: ' + ', '.join(LOG_LEVELS))
+            exit(9)
+        if options['processes'] > 1 and not hasattr(os, 'fork'):
+            self.print_usage_message('Option --processes requires a platform with fork()!')
+            exit(9)
+        return port, root_directory, options
+
+    def parse_options(self, arguments):
+        """
+        Parses optional trailing command line arguments of the form --name=value, filling in
+        defaults for any that are not provided. Values are converted to the type of the default.
+        N.B. Will exit the process if an argument is not of the expected form.
+        :param arguments: [string, ...] list of the optional command line arguments.
+        :return: a dictionary mapping option names (string) to values (string or int).
+        """
+        options = dict(DEFAULT_OPTIONS)
+        for argument in arguments:
+            name, _, value = argument.partition('=')
+            if not name.startswith('--') or name[2:] not in options or not value:
+                self.print_usage_message('Unrecognised option: ' + argument)
+                exit(8)
+            try:
+                options[name[2:]] = type(DEFAULT_OPTIONS[name[2:]])(value)
+            except ValueError:
+                self.print_usage_message('Option {} is not an integer!'.format(name))
+                exit(8)
+        return options
 
     def print_usage_message(self, message_header):
         """
@@ -70,22 +187,59 @@ class BasicHTTPServer(object):
         :return: None
         """
         base_message = 'Server startup failed!\n' \
-                       'Usage: python3 http-server.py <port> <root_directory>\n'
+                       'Usage: python3 http-server.py <port> <root_directory> [options...]\n' \
+                       'N.B: Options are given as --name=value, see README.txt for the full list.\n'
         print(message_header + '\n' + base_message)
 
     def graceful_shutdown(self, signum, frame):
         """
-        Shuts down the server on KeyboardInterrupt, closing any open sockets.
+        Shuts down the server on KeyboardInterrupt: no new clients are accepted, idle
+        connections are closed and replies in progress are given up to the drain timeout to
+        finish before the server exits. The event loop engine drains itself (see
+        drain_event_loop), so this only flags the shutdown there.
         :param signum: not used
         :param frame: not used
         :return: None
         """
+        if self.draining:  # Already shutting down, e.g. interrupted by terminal and supervisor.
+            return
+        self.draining = True
         print('\nReceived interrupt: Shutting down...')
-        for connection in self.connections:  # Try to shut down any active connections
-            try:
-                connection.shutdown()
-            except Exception:  # Skip any that are already closed.
-                pass
+        self.log_handler.flush()
+        if self.worker_processes:  # Supervisor, pass the interrupt on and wait for the workers.
+            workers, self.worker_processes = self.worker_processes, {}  # Stop respawning.
+            for pid in workers:
+                try:
+                    os.kill(pid, SIGINT)
+                except ProcessLookupError:  # Already exited.
+                    pass
+            for pid in workers:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:  # Already reaped.
+                    pass
+            exit(1)
+        if self.options['engine'] == 'async' and self.listening is not None:
+            return
+        if self.listening is not None:
+            self.listening.close()  # Refuse new clients.
+        deadline = monotonic() + self.options['drain-timeout']
+        while self.registry and monotonic() < deadline:
+            for connection in self.registry.idle():  # Wakes its worker, which closes it.
+                shutdown_connection(connection)
+            sleep(DRAIN_POLL)
+        self.finish_shutdown()
+
+    def finish_shutdown(self):
+        """
+        Shuts down any connections still open, reports the cache statistics and exits.
+        :return: None
+        """
+        for connection in self.registry.all():
+            shutdown_connection(connection)
+        print('Response cache: {hits} hits, {misses} misses, {evictions} evictions, '
+              '{entries} entries ({size} bytes)'.format(**self.cache.stats()))
+        self.log_handler.flush()
         exit(1)
 
     def run_server(self):
@@ -94,17 +248,421 @@ class BasicHTTPServer(object):
         interrupted by user.
         :return: None
         """
+        self.log_handler.start()
+        if self.options['processes'] > 1:
+            self.run_supervisor()
+            return
+        sock = self.open_listening_socket()
+        self.start_admin_server()
+        print('Server started, (listening on {}:{}) waiting for connection...'
+              .format(gethostbyname(self.host), self.port))
+        self.serve(sock)
+
+    def start_admin_server(self):
+        """
+        Starts a thread answering GET /metrics on the admin port (if one is configured) with
+        the server's metrics, summed over every process, in the Prometheus text format.
+        :return: None
+        """
+        if self.options['admin-port']:
+            serve_metrics(self.host, self.options['admin-port'], self.metrics, self.log)
+
+    def open_listening_socket(self, reuse_port=False):
+        """
+        Creates the server's bound, listening socket.
+        :param reuse_port: if True, SO_REUSEPORT is set so that several processes may each bind
+        their own socket to the port, with the kernel balancing new connections among them.
+        :return: the listening socket.
+        """
         sock = socket(AF_INET, SOCK_STREAM)  # TCP, IPV4
         sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # Free port immediately on exit
+        if reuse_port:
+            sock.setsockopt(SOL_SOCKET, sockets.SO_REUSEPORT, 1)
         sock.bind((self.host, self.port))
-        sock.listen(10)  # 10 pending connections allowed
-        print('Server started, (listening on {}:{}) waiting for connection...'
-              .format(gethostbyname(self.host), self.port))
+        sock.listen(self.options['backlog'])
+        return sock
+
+    def run_supervisor(self):
+        """
+        Forks the configured number of worker processes, each serving clients on the port
+        with the chosen engine, and respawns any worker that dies. Where SO_REUSEPORT is
+        available each worker binds its own socket, otherwise they share one inherited socket.
+        Runs until deliberately interrupted by user (see graceful_shutdown).
+        :return: None
+        """
+        shared = None if hasattr(sockets, 'SO_REUSEPORT') else self.open_listening_socket()
+        for slot in range(self.options['processes']):
+            self.spawn_worker_process(shared, slot)
+        self.start_admin_server()  # Only once every worker is forked, threads do not survive fork.
+        print('Server started, (listening on {}:{} with {} processes) waiting for connection...'
+              .format(gethostbyname(self.host), self.port, self.options['processes']))
+        while True:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:  # No workers left.
+                return
+            started, slot = self.worker_processes.pop(pid, (None, None))
+            if started is None:  # Not a worker, or shutting down.
+                continue
+            self.log.warning('Worker process %d exited with status %d, respawning...', pid, status)
+            if monotonic() - started < RESPAWN_DELAY:  # Dying on startup, avoid a fork storm.
+                sleep(RESPAWN_DELAY)
+            self.spawn_worker_process(shared, slot)
+
+    def spawn_worker_process(self, shared, slot):
+        """
+        Forks a worker process which serves clients until it is interrupted.
+        :param shared: the inherited listening socket to serve on, or None for the worker to
+        bind its own with SO_REUSEPORT.
+        :param slot: the worker's slot in the shared metrics (that of the worker it replaces).
+        :return: None
+        """
+        pid = os.fork()
+        if pid:  # Supervisor.
+            self.worker_processes[pid] = (monotonic(), slot)
+            return
+        self.worker_processes = {}  # Workers have no workers of their own.
+        self.metrics.use_slot(slot)
+        self.log_handler.start()  # The writer thread does not survive fork.
+        try:
+            self.serve(shared or self.open_listening_socket(reuse_port=True))
+        except SystemExit as error:  # graceful_shutdown.
+            os._exit(error.code)
+        except Exception:
+            print_exc()
+        finally:
+            self.log_handler.flush()
+            os._exit(1)  # Never return into the supervisor's loop.
+
+    def serve(self, sock):
+        """
+        Serves clients accepted on a listening socket with the configured engine until
+        deliberately interrupted by user.
+        :param sock: the bound and listening server socket.
+        :return: None
+        """
+        self.listening = sock
+        if self.options['engine'] == 'async':
+            self.run_event_loop(sock)
+        # Clients waiting for a worker, as (connection, RequestParser or None, requests served).
+        pending = Queue(self.options['queue'])
+        for _ in range(self.options['workers']):  # Fixed pool, no thread is spawned per client.
+            start_new_thread(self.run_worker, (pending,))
+        self.parking_wakeup = socketpair()
+        self.parking_wakeup[1].setblocking(False)
+        start_new_thread(self.run_idle_loop, (pending,))
         while True:
             connection, address = sock.accept()
-            self.connections.append(connection)
-            print('Server connected to {} at {}'.format(address, ctime(time())))
-            start_new_thread(self.handle_client, (connection,))  # Start thread for each client.
+            self.registry.add(connection)
+            self.metrics.add('http_connections_accepted_total')
+            self.metrics.add('http_connections_active')
+            self.log.debug('Server connected to %s', address)
+            try:
+                pending.put_nowait((connection, None, 0))
+            except Full:  # Every worker busy and queue full, shed rather than queue unboundedly.
+                self.shed_client(connection)
+
+    def run_worker(self, pending):
+        """
+        Body of each pool thread: serves queued clients one at a time, forever.
+        :param pending: the Queue of clients waiting for a worker.
+        :return: None
+        """
+        while True:
+            connection, parser, served = pending.get()
+            try:
+                if self.handle_client(connection, parser, served):
+                    continue  # Parked until its next request arrives.
+            except Exception as error:  # Never let one bad client take a worker down with it.
+                self.log.error('Client handler failed: %s', error)
+            self.close_client(connection)
+
+    def close_client(self, connection):
+        """
+        Closes a thread engine client's connection and forgets it.
+        :param connection: the socket connection to the client.
+        :return: None
+        """
+        connection.close()
+        self.registry.remove(connection)
+        self.metrics.add('http_connections_active', -1)
+
+    def park_client(self, connection, parser, served):
+        """
+        Hands a keep-alive connection with no request waiting to the idle loop, so it does not
+        hold a worker until the client sends its next request.
+        :param connection: the socket connection to the client.
+        :param parser: the connection's RequestParser.
+        :param served: the number of requests served on the connection.
+        :return: None
+        """
+        # Nothing buffered, so owed nothing (even before its first request) and may be closed
+        # at shutdown.
+        self.registry.set_idle(connection, True)
+        self.parking.put((connection, parser, served))
+        try:
+            self.parking_wakeup[1].send(b'\0')
+        except BlockingIOError:  # Wakeups already pending, the idle loop will see this one.
+            pass
+
+    def run_idle_loop(self, pending):
+        """
+        Body of the idle thread: watches every parked connection on one selector, queueing a
+        connection for a worker again once its next request starts to arrive, and closing
+        those idle for longer than the keep-alive timeout.
+        :param pending: the Queue of clients waiting for a worker.
+        :return: None
+        """
+        selector = DefaultSelector()
+        wakeup = self.parking_wakeup[0]
+        selector.register(wakeup, EVENT_READ)
+        parked = OrderedDict()  # Connection -> time parked, oldest first.
+        timeout = self.options['keep-alive-timeout']
+        while True:
+            wait = None
+            if parked:
+                wait = max(next(iter(parked.values())) + timeout - monotonic(), 0)
+            for key, _ in selector.select(wait):
+                if key.data is None:  # Newly parked connections.
+                    wakeup.recv(RECV_SIZE)
+                    while not self.parking.empty():
+                        client = self.parking.get()
+                        selector.register(client[0], EVENT_READ, client)
+                        parked[client[0]] = monotonic()
+                    continue
+                selector.unregister(key.fileobj)
+                del parked[key.fileobj]
+                if self.draining:  # Readable only because shutdown closed it.
+                    self.close_client(key.fileobj)
+                    continue
+                self.registry.set_idle(key.fileobj, False)
+                try:
+                    pending.put_nowait(key.data)
+                except Full:  # Every worker busy and queue full, shed as for a new client.
+                    self.shed_client(key.fileobj)
+            now = monotonic()
+            while parked and next(iter(parked.values())) + timeout <= now:
+                connection, _ = parked.popitem(last=False)
+                selector.unregister(connection)
+                self.close_client(connection)
+
+    def shed_client(self, connection):
+        """
+        Turns away a client when the server is saturated with a fast 503 response.
+        :param connection: the socket connection to the client.
+        :return: None
+        """
+        self.log.warning('Server overloaded, rejecting client.')
+        self.metrics.add('http_connections_shed_total')
+        try:
+            connection.sendall(error_reply('503 Service Unavailable').head(False))
+        except OSError:  # Client already gone, nothing to tell it.
+            pass
+        self.close_client(connection)
+
+    def run_event_loop(self, sock):
+        """
+        Serves clients from a single thread, multiplexing every connection over one selector
+        (epoll/kqueue where available) so idle clients cost a registration rather than a thread.
+        Runs until deliberately interrupted by user.
+        :param sock: the bound and listening server socket.
+        :return: None
+        """
+        raise_file_limit()
+        selector = DefaultSelector()
+        sock.setblocking(False)
+        selector.register(sock, EVENT_READ)  # Listening socket is the only key without a client.
+        self.idle_clients = OrderedDict()  # AsyncClient -> None, least recently active first.
+        deadline = None  # When draining must end, once shutdown has begun.
+        while True:
+            for key, events in selector.select(1.0):  # Wake at least every second to expire clients.
+                if key.data is None:
+                    self.accept_clients(selector, sock)
+                else:
+                    self.service_client(selector, key.data, events)
+            self.expire_idle_clients(selector)
+            if self.draining:
+                if deadline is None:  # Interrupted since the last pass, stop accepting.
+                    deadline = monotonic() + self.options['drain-timeout']
+                    selector.unregister(sock)
+                    sock.close()
+                self.drain_event_loop(selector, deadline)
+
+    def drain_event_loop(self, selector, deadline):
+        """
+        Closes the event loop's idle clients while the server is shutting down, leaving those
+        with a request or reply in progress to finish (their replies close the connection),
+        and exits once none are left or the deadline passes.
+        :param selector: the selector used by run_event_loop.
+        :param deadline: the monotonic time by which the server exits regardless.
+        :return: None
+        """
+        for client in list(self.idle_clients):
+            if not (client.parser.in_progress() or client.outbound or client.file is not None):
+                self.close_async_client(selector, client)
+        if not self.idle_clients or monotonic() >= deadline:
+            self.finish_shutdown()
+
+    def accept_clients(self, selector, sock):
+        """
+        Accepts every connection pending on the listening socket and registers it for reading.
+        :param selector: the selector used by run_event_loop.
+        :param sock: the non-blocking listening socket.
+        :return: None
+        """
+        while True:
+            try:
+                connection, address = sock.accept()
+            except (BlockingIOError, InterruptedError):  # Backlog drained.
+                return
+            except OSError as error:  # e.g. out of file descriptors, retry on next event.
+                self.log.error('Accept failed: %s', error)
+                return
+            connection.setblocking(False)
+            self.registry.add(connection)
+            self.metrics.add('http_connections_accepted_total')
+            self.metrics.add('http_connections_active')
+            self.log.debug('Server connected to %s', address)
+            client = AsyncClient(connection)
+            selector.register(connection, EVENT_READ, client)
+            self.touch_client(client)
+
+    def service_client(self, selector, client, events):
+        """
+        Reads requests from and/or writes pending replies to a ready client, giving the same
+        replies as handle_client.
+        :param selector: the selector used by run_event_loop.
+        :param client: the AsyncClient state of the ready connection.
+        :param events: the selector event mask the connection is ready for.
+        :return: None
+        """
+        try:
+            if events & EVENT_READ:
+                data = client.connection.recv(RECV_SIZE)
+                if not data:  # Client closed its end.
+                    self.close_async_client(selector, client)
+                    return
+                client.parser.feed(data)
+            self.flush_client(client)
+            writing = client.closing or client.outbound or client.file is not None
+            if client.parser.in_progress() and not writing:  # Part way through a request.
+                if client.deadline is None:
+                    client.deadline = monotonic() + self.options['read-timeout']
+                elif monotonic() > client.deadline:  # Trickling the request in, drop it.
+                    raise timeout()
+            else:
+                client.deadline = None
+        except (BlockingIOError, InterruptedError):
+            pass  # Socket buffer full, wait for next event.
+        except (OSError, EOFError):  # Connection reset or file vanished mid-response.
+            self.close_async_client(selector, client)
+            return
+        writing = client.outbound or client.file is not None
+        if client.closing and not writing:  # Final reply sent.
+            self.close_async_client(selector, client)
+            return
+        self.touch_client(client)
+        selector.modify(client.connection, EVENT_WRITE if writing else EVENT_READ, client)
+
+    def flush_client(self, client):
+        """
+        Queues replies to any complete requests the client has sent and writes as much
+        pending reply data as the socket will accept without blocking.
+        :param client: the AsyncClient state of the connection.
+        :return: None
+        """
+        while True:
+            self.queue_replies(client)
+            if client.outbound:
+                sent = client.connection.send(client.outbound)
+                self.metrics.add('http_response_bytes_total', sent)
+                del client.outbound[:sent]
+                if client.outbound:  # Socket buffer full.
+                    return
+            elif client.file is not None:  # Header sent, stream the body.
+                sent = send_file_chunk(client.connection, client.file, client.offset,
+                                       client.remaining)
+                if sent == 0:  # File shrank since the header was sent, response cannot complete.
+                    raise EOFError(client.file.name)
+                self.metrics.add('http_response_bytes_total', sent)
+                client.offset += sent
+                client.remaining -= sent
+                if client.remaining:
+                    return
+                client.file.close()
+                client.file = None
+            else:  # Nothing left to write.
+                return
+
+    def queue_replies(self, client):
+        """
+        Appends replies to the client's buffered (possibly pipelined) requests to its outbound
+        data, in order, stopping at a streamed reply, the final reply or OUTBOUND_LIMIT.
+        :param client: the AsyncClient state of the connection.
+        :return: None
+        """
+        while client.file is None and not client.closing and len(client.outbound) < OUTBOUND_LIMIT:
+            try:
+                request = client.parser.next_request()
+            except ValueError:  # Malformed request, the stream cannot be resynchronised.
+                client.outbound += error_reply('400 Bad Request').head(False)
+                client.closing = True
+                return
+            if request is None:  # Waiting for more data.
+                return
+            started = perf_counter()
+            client.served += 1
+            keep_alive = self.keep_alive(request, client.served)
+            reply = self.build_reply(request)
+            client.outbound += reply.head(keep_alive)
+            if request.method != 'HEAD':
+                client.outbound += reply.body
+                if reply.file_name is not None:
+                    client.file = open(reply.file_name, 'rb')
+                    client.offset, client.remaining = reply.offset, reply.length
+            client.closing = not keep_alive
+            self.metrics.add('http_requests_total')
+            self.metrics.observe(perf_counter() - started)
+
+    def touch_client(self, client):
+        """
+        Records activity on a connection, postponing its idle expiry.
+        :param client: the AsyncClient state of the connection.
+        :return: None
+        """
+        client.last_active = monotonic()
+        self.idle_clients[client] = None
+        self.idle_clients.move_to_end(client)
+
+    def expire_idle_clients(self, selector):
+        """
+        Closes connections that have been inactive for longer than the keep-alive timeout.
+        Only the expired clients (at the front of idle_clients) are visited.
+        :param selector: the selector used by run_event_loop.
+        :return: None
+        """
+        deadline = monotonic() - self.options['keep-alive-timeout']
+        while self.idle_clients:
+            client = next(iter(self.idle_clients))
+            if client.last_active > deadline:
+                return
+            self.close_async_client(selector, client)
+
+    def close_async_client(self, selector, client):
+        """
+        Unregisters and closes a connection serviced by the event loop.
+        :param selector: the selector used by run_event_loop.
+        :param client: the AsyncClient state of the connection to close.
+        :return: None
+        """
+        selector.unregister(client.connection)
+        self.idle_clients.pop(client, None)
+        client.connection.close()
+        if client.file is not None:
+            client.file.close()
+        self.registry.remove(client.connection)
+        self.metrics.add('http_connections_active', -1)
+        self.log.debug('Connection closed.')
 
     def is_valid_file(self, path):
         """
@@ -124,43 +682,665 @@ class BasicHTTPServer(object):
             except IsADirectoryError:  # Do not accept directories
                 return False
 
-    def get_file_contents(self, path):
+    def resolve_path(self, path):
         """
-        Takes a file path and returns the contents of that file as a string.
-        :param path: the file path, represented as a string
-        :return: A string representation of the contents of the requested file.
+        Maps a requested path onto the file that should be served for it and the matching
+        response status.
+        :param path: the requested file path, represented as a string.
+        :return: a tuple of the status line (string) and the file to serve (string).
         """
+        if not self.is_valid_file(path):  # If file not found, choose 404 file.
+            return '404 Not Found', NOT_FOUND_FILE
         if path == '/':  # Accept
-            path = DEFAULT_FILE
-        else:
-            if not self.is_valid_file(path):  # If file not found, choose 404 file.
-                path = NOT_FOUND_FILE
+            return '200 OK', DEFAULT_FILE
+        return '200 OK', path[1:]  # Strip leading slash.
+
+    def resolve_variant(self, key):
+        """
+        Maps a request path and content coding onto the file to build the response from,
+        preferring an up to date precompressed sibling (e.g. index.html.gz) for gzip.
+        :param key: a tuple of the requested file path and content coding (or None).
+        :return: a tuple of the status line (string) and the file to serve (string).
+        """
+        path, encoding = key
+        status, file_name = self.resolve_path(path)
+        compressed = file_name + '.gz'
+        if encoding == 'gzip' and status == '200 OK' and isfile(compressed) and \
+                os.stat(compressed).st_mtime_ns >= os.stat(file_name).st_mtime_ns:
+            return status, compressed
+        return status, file_name
+
+    def get_file_contents(self, file_name):
+        """
+        Takes the name of a file to serve and returns its contents, unaltered.
+        :param file_name: the file path relative to the root directory, represented as a string.
+        :return: the contents of the requested file as bytes.
+        """
+        with open(file_name, 'rb') as file:
+            return file.read()
+
+    def build_response(self, key, status, file_name, info):
+        """
+        Builds the response serving the given file. Files up to STREAM_THRESHOLD bytes are
+        read into the reply (and compressed if a content coding was negotiated), larger ones
+        are left on disk to be streamed by send_reply. Successful responses carry the file's
+        validators (ETag and Last-Modified).
+        :param key: a tuple of the requested file path and content coding (or None).
+        :param status: the status line, e.g. '200 OK'.
+        :param file_name: the file to serve as the body, as given by resolve_variant.
+        :param info: the os.stat_result of the file.
+        :return: a Reply.
+        """
+        path, encoding = key
+        precompressed = encoding == 'gzip' and file_name.endswith('.gz') and \
+            not path.endswith('.gz')
+        content_type = guess_type(file_name[:-3] if precompressed else file_name)[0] or \
+            DEFAULT_CONTENT_TYPE
+        body = b''
+        if not precompressed and encoding is not None:
+            if info.st_size > STREAM_THRESHOLD or info.st_size < COMPRESS_MIN_SIZE:
+                encoding = None  # Too big to compress in memory or too small to benefit.
             else:
-                path = path[1:]  # Strip leading slash.
-        contents = ''
-        with open(path) as file:
-            contents += file.read()
-        return contents
-
-    def handle_client(self, connection):
-        """
-        This method is called when a new thread is spawned by run_server and provides
-        a HTTP response to the user with the requested file.
-        :param connection:
-        :return: None
-        """
-        while True:  # read, write a client socket
-            data = connection.recv(1024)
-            if not data:
-                break
-            request = data.decode().split('\n')[0]  # Get first line of request.
-            file_path = request.split(' ')[1]  # Get requested file path.
-            body = self.get_file_contents(file_path)
-            body_length = len(body.encode())  # Get length for content length header.
-            reply = HTML_HEADER_FORMAT.format("200 OK" if self.is_valid_file(file_path)
-                                              else "404 Not Found", body_length) + body
-            connection.sendall(reply.encode())  # Send until no more data.
-        connection.close()
+                body = self.get_file_contents(file_name)
+                compressed = compress_body(body, encoding)
+                if len(compressed) < len(body):
+                    body = compressed
+                else:  # Incompressible content.
+                    encoding = None
+        extra_headers = []
+        if encoding is not None:
+            extra_headers.append(('Content-Encoding', encoding))
+        if is_compressible(content_type):  # Response depends on the client's Accept-Encoding.
+            extra_headers.append(('Vary', 'Accept-Encoding'))
+        etag, modified = None, None
+        if status == '200 OK':  # Only the requested resource itself may be revalidated.
+            etag = '"{:x}-{:x}{}"'.format(info.st_mtime_ns, info.st_size,
+                                          '-' + encoding if encoding else '')
+            modified = int(info.st_mtime)
+        if not body and info.st_size > STREAM_THRESHOLD:
+            header = format_header(status, content_type, info.st_size, etag, modified,
+                                   extra_headers)
+            return Reply(header, b'', file_name, 0, info.st_size, content_type, etag, modified,
+                         extra_headers)
+        body = body or self.get_file_contents(file_name)
+        header = format_header(status, content_type, len(body), etag, modified, extra_headers)
+        return Reply(header, body, None, 0, 0, content_type, etag, modified, extra_headers)
+
+    def negotiate_encoding(self, request):
+        """
+        Chooses the content coding for a response from the request's Accept-Encoding header.
+        Types that do not compress well (images, archives, etc.) are always sent as is.
+        :param request: the Request received from the client.
+        :return: the chosen coding from ENCODINGS, or None for no coding.
+        """
+        content_type, encoding = guess_type(DEFAULT_FILE if request.path == '/' else request.path)
+        if encoding is not None or not is_compressible(content_type):
+            return None
+        qualities = {}
+        for item in request.headers.get('accept-encoding', '').split(','):
+            name, _, parameters = item.partition(';')
+            quality = 1.0
+            if parameters.strip().startswith('q='):
+                try:
+                    quality = float(parameters.strip()[2:])
+                except ValueError:  # Malformed, treat as not acceptable.
+                    quality = 0.0
+            qualities[name.strip().lower()] = quality
+        for encoding in ENCODINGS:
+            if qualities.get(encoding, qualities.get('*', 0.0)) > 0:
+                return encoding
+        return None
+
+    def is_not_modified(self, request, reply):
+        """
+        Evaluates a request's If-None-Match or (failing that) If-Modified-Since header against
+        the validators of the reply it would receive.
+        :param request: the Request received from the client.
+        :param reply: the full Reply for the requested file.
+        :return: True if the client's copy is current and a 304 should be sent instead.
+        """
+        if 'if-none-match' in request.headers:  # Takes precedence over If-Modified-Since.
+            tags = [tag.strip() for tag in request.headers['if-none-match'].split(',')]
+            return '*' in tags or reply.etag in [tag[2:] if tag.startswith('W/') else tag
+                                                 for tag in tags]
+        if 'if-modified-since' in request.headers:
+            try:
+                since = parsedate_to_datetime(request.headers['if-modified-since']).timestamp()
+            except (TypeError, ValueError):  # Unparsable date, ignore the header.
+                return False
+            return reply.modified <= since
+        return False
+
+    def requested_range(self, request, reply):
+        """
+        Determines the byte range of the body a request asks for. Only single ranges are
+        honoured, multiple ranges (or a stale If-Range) get the whole body.
+        :param request: the Request received from the client.
+        :param reply: the full Reply for the requested file.
+        :return: a (first, last) tuple of inclusive byte positions, None for the whole body,
+        or False if the range cannot be satisfied.
+        """
+        value = request.headers.get('range', '')
+        if not value.startswith('bytes=') or ',' in value:
+            return None
+        if 'if-range' in request.headers and request.headers['if-range'] != reply.etag:
+            return None
+        total = reply.total()
+        first, separator, last = value[6:].strip().partition('-')
+        try:
+            if not separator:
+                return None
+            if not first:  # Suffix range: the final N bytes.
+                first, last = max(total - int(last), 0), total - 1
+                if first > last:  # A suffix of no bytes (or an empty body), unsatisfiable.
+                    return False
+            else:
+                first, last = int(first), int(last) if last else total - 1
+        except ValueError:  # Malformed range, ignore the header.
+            return None
+        if first > last:  # Invalid (e.g. bytes=5-3) rather than unsatisfiable, so ignored.
+            return None
+        if first >= total:
+            return False
+        return first, min(last, total - 1)
+
+    def handle_client(self, connection, parser=None, served=0):
+        """
+        This method is called by a pool worker for each client accepted by run_server and
+        provides HTTP responses to each of the (possibly pipelined) requests the client sends,
+        until it closes the connection, asks for the connection to be closed or has no request
+        waiting. A connection with no request waiting is parked (see run_idle_loop) rather
+        than holding the worker, and is queued for a worker again once its next request begins.
+        Clients that are too slow to send a request or to read a reply are dropped, so they
+        cannot hold a worker indefinitely.
+        :param connection: the socket connection to the client.
+        :param parser: the connection's RequestParser, if resuming a parked connection.
+        :param served: the number of requests already served on the connection.
+        :return: True if the connection was parked, False if it was closed.
+        """
+        if parser is None:  # Newly accepted.
+            parser = RequestParser()
+            set_send_timeout(connection, self.options['write-timeout'])
+        deadline = None  # When the request being received must have arrived in full.
+        parked = False
+        try:
+            while True:  # read, write a client socket
+                try:
+                    request = parser.next_request()
+                except ValueError:  # Malformed request, the stream cannot be resynchronised.
+                    connection.sendall(error_reply('400 Bad Request').head(False))
+                    break
+                if request is None:  # Need more data.
+                    if parser.in_progress():  # Part way through a request.
+                        deadline = deadline or monotonic() + self.options['read-timeout']
+                        wait = deadline - monotonic()
+                        if wait <= 0:
+                            break
+                        connection.settimeout(wait)
+                        data = connection.recv(RECV_SIZE)
+                        connection.settimeout(None)  # sendfile requires a blocking socket.
+                    else:  # Between requests, read only what has already arrived.
+                        if self.draining:
+                            break
+                        try:
+                            data = connection.recv(RECV_SIZE, MSG_DONTWAIT)
+                        except BlockingIOError:  # Nothing yet, park rather than wait.
+                            self.park_client(connection, parser, served)
+                            parked = True
+                            return True
+                    if not data:
+                        break
+                    parser.feed(data)
+                    continue
+                deadline = None
+                started = perf_counter()
+                served += 1
+                keep_alive = self.keep_alive(request, served)
+                sent = self.send_reply(connection, self.build_reply(request), keep_alive,
+                                       request.method == 'HEAD')
+                self.metrics.add('http_requests_total')
+                self.metrics.add('http_response_bytes_total', sent)
+                self.metrics.observe(perf_counter() - started)
+                if not keep_alive:
+                    break
+        except (timeout, BlockingIOError):  # Too slow to send a request or to read a reply.
+            pass
+        finally:
+            if not parked:
+                connection.close()
+        return False
+
+    def keep_alive(self, request, served):
+        """
+        Decides whether the connection should be kept open after replying to a request, as per
+        the HTTP version's default, the client's Connection header and the max-requests limit.
+        :param request: the Request being replied to.
+        :param served: the number of requests served on the connection, including this one.
+        :return: True if the connection should persist, otherwise False.
+        """
+        if served >= self.options['max-requests'] or self.draining:
+            return False
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+    def send_reply(self, connection, reply, keep_alive, head_only=False):
+        """
+        Sends a reply on a blocking connection, streaming any file body straight from disk so
+        memory use does not grow with the size of the file.
+        :param connection: the socket connection to the client.
+        :param reply: the Reply to send.
+        :param keep_alive: whether the connection will be kept open after this reply.
+        :param head_only: if True only the header is sent (HEAD requests).
+        :return: the number of bytes sent.
+        """
+        head = reply.head(keep_alive)
+        if head_only:
+            connection.sendall(head)
+            return len(head)
+        connection.sendall(head + reply.body)  # Send until no more data.
+        if reply.file_name is None:
+            return len(head) + len(reply.body)
+        with open(reply.file_name, 'rb') as file:
+            offset, remaining = reply.offset, reply.length
+            while remaining:
+                sent = send_file_chunk(connection, file, offset, remaining)
+                if sent == 0:  # File shrank since the header was sent, response cannot complete.
+                    raise EOFError(reply.file_name)
+                offset += sent
+                remaining -= sent
+        return len(head) + len(reply.body) + reply.length
+
+    def build_reply(self, request):
+        """
+        Builds the HTTP response to a request, shared by every serving engine.
+        :param request: the parsed Request received from the client.
+        :return: the Reply to send.
+        """
+        if request.method not in METHODS:
+            return error_reply('501 Not Implemented')
+        key = (request.path, self.negotiate_encoding(request))
+        reply = self.cache.get(key, self.resolve_variant, self.build_response)
+        if reply.etag is None:  # Not found, nothing to revalidate or take a range of.
+            return reply
+        if self.is_not_modified(request, reply):
+            return Reply(format_header('304 Not Modified', None, None, reply.etag, reply.modified,
+                                       reply.extra_headers))
+        byte_range = self.requested_range(request, reply)
+        if byte_range is False:
+            header = format_header('416 Range Not Satisfiable', 'text/html', 0, reply.etag,
+                                   reply.modified, [('Content-Range',
+                                                     'bytes */{}'.format(reply.total()))])
+            return Reply(header)
+        if byte_range is None:
+            return reply
+        first, last = byte_range
+        header = format_header('206 Partial Content', reply.content_type, last - first + 1,
+                               reply.etag, reply.modified, reply.extra_headers +
+                               [('Content-Range', 'bytes {}-{}/{}'.format(first, last,
+                                                                          reply.total()))])
+        if reply.file_name is None:
+            return Reply(header, reply.body[first:last + 1])
+        return Reply(header, b'', reply.file_name, reply.offset + first, last - first + 1)
+
+
+class Request(object):
+    """
+    A request parsed by the RequestParser.
+    """
+    __slots__ = ('method', 'path', 'version', 'headers')
+
+    def __init__(self, method, path, version, headers):
+        self.method = method  # e.g. 'GET'
+        self.path = path  # Requested file path, e.g. '/index.html'
+        self.version = version  # e.g. 'HTTP/1.1'
+        self.headers = headers  # {lower case name: value}
+
+
+class RequestParser(object):
+    """
+    Incremental HTTP request parser. Received data is fed in as it arrives, in whatever pieces
+    TCP delivers it, and complete requests are taken out one at a time, so requests split
+    across segments and several pipelined requests in one segment are both handled. Request
+    bodies are thrown away as they arrive rather than buffered, and a request's head is parsed
+    once, however many pieces its body arrives in.
+    """
+    __slots__ = ('buffer', 'request', 'remaining')
+
+    def __init__(self):
+        self.buffer = bytearray()  # Received bytes not yet parsed into a request.
+        self.request = None  # Request whose head has been parsed, while its body arrives.
+        self.remaining = 0  # Bytes of that request's body still to be received and discarded.
+
+    def feed(self, data):
+        """
+        Adds received data to the buffer, less any of it discarded as request body.
+        :param data: bytes received from the client.
+        :return: None
+        """
+        if self.remaining:
+            skipped = min(self.remaining, len(data))
+            self.remaining -= skipped
+            data = data[skipped:]
+        self.buffer += data
+
+    def in_progress(self):
+        """
+        :return: True if part way through receiving a request, otherwise False.
+        """
+        return bool(self.buffer) or self.request is not None
+
+    def next_request(self):
+        """
+        Removes and returns the first complete request in the buffer. Any request body is
+        discarded (only GET and HEAD are served).
+        N.B. Raises ValueError if the buffered data is not a valid request.
+        :return: the next Request, or None if no complete request has been received yet.
+        """
+        if self.request is None and not self.parse_head():
+            return None
+        if self.remaining:  # Body still arriving.
+            return None
+        request, self.request = self.request, None
+        return request
+
+    def parse_head(self):
+        """
+        Parses the request line and headers at the start of the buffer, if they have arrived in
+        full, into self.request, removing them and whatever of the body has been received.
+        N.B. Raises ValueError if the buffered data is not a valid request.
+        :return: True if a head was parsed, False if it has not been received in full yet.
+        """
+        while self.buffer.startswith(b'\r\n') or self.buffer.startswith(b'\n'):  # Stray CRLFs.
+            del self.buffer[:1]
+        end = self.buffer.find(b'\n\r\n')
+        terminator = 3
+        bare_end = self.buffer.find(b'\n\n')  # Tolerate clients terminating lines with LF only.
+        if bare_end != -1 and (end == -1 or bare_end < end):
+            end, terminator = bare_end, 2
+        if end == -1:
+            if len(self.buffer) > MAX_REQUEST_SIZE:
+                raise ValueError('Request header too large')
+            return False
+        lines = self.buffer[:end].decode('latin-1').split('\n')
+        parts = lines[0].strip().split(' ')
+        if len(parts) != 3 or not parts[1] or not parts[2].startswith('HTTP/'):
+            raise ValueError('Malformed request line')
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            if not separator:
+                raise ValueError('Malformed header')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))  # ValueError if not a number.
+        if length < 0:
+            raise ValueError('Negative Content-Length')
+        del self.buffer[:end + terminator]
+        skipped = min(length, len(self.buffer))
+        del self.buffer[:skipped]
+        self.remaining = length - skipped
+        self.request = Request(parts[0], parts[1], parts[2], headers)
+        return True
+
+
+class Reply(object):
+    """
+    A response ready to send: an encoded header (less the Connection header, which depends on
+    the connection it is sent on) and body, optionally followed by a range of a file that is
+    streamed from disk rather than held in memory.
+    """
+    __slots__ = ('header', 'body', 'file_name', 'offset', 'length', 'content_type', 'etag',
+                 'modified', 'extra_headers')
+
+    def __init__(self, header, body=b'', file_name=None, offset=0, length=0, content_type=None,
+                 etag=None, modified=None, extra_headers=()):
+        self.header = header  # Status line and headers as bytes, without the closing blank line.
+        self.body = body  # Body bytes (empty if streamed).
+        self.file_name = file_name  # File to stream after the body, or None.
+        self.offset = offset  # First byte of the file to stream.
+        self.length = length  # Number of bytes of the file to stream.
+        self.content_type = content_type  # MIME type of the body.
+        self.etag = etag  # Entity tag of the served file, None if it may not be revalidated.
+        self.modified = modified  # Modification time (whole seconds) of the served file.
+        self.extra_headers = list(extra_headers)  # [(name, value)] repeated in 304/206 replies.
+
+    def head(self, keep_alive):
+        """
+        Completes the header for sending on a connection.
+        :param keep_alive: whether the connection will be kept open after this reply.
+        :return: the full header as bytes.
+        """
+        return self.header + (KEEP_ALIVE_HEADER if keep_alive else CLOSE_HEADER)
+
+    def size(self):
+        """
+        :return: the bytes of memory held by the reply's header and body.
+        """
+        return len(self.header) + len(self.body)
+
+    def total(self):
+        """
+        :return: the length in bytes of the full body, whether held in memory or streamed.
+        """
+        return len(self.body) + self.length
+
+
+class CacheEntry(object):
+    """
+    A built response held by the ResponseCache, with the file details it was built from.
+    """
+    __slots__ = ('status', 'file_name', 'mtime', 'size', 'checked', 'reply')
+
+    def __init__(self, status, file_name, mtime, size, checked, reply):
+        self.status = status  # Status line the response was built with.
+        self.file_name = file_name  # File served as the body.
+        self.mtime = mtime  # Modification time (ns) of the file when built.
+        self.size = size  # Size of the file when built.
+        self.checked = checked  # Monotonic time the entry was last validated.
+        self.reply = reply  # The complete Reply.
+
+
+class ResponseCache(object):
+    """
+    Thread-safe, memory-capped LRU cache of complete (pre-encoded, and possibly compressed)
+    responses keyed by request path and content coding. Entries are re-validated against the
+    served file's mtime and size at most once every CACHE_REVALIDATE_INTERVAL seconds, so hot
+    files are served without touching the file system at all. Streamed (large file) responses
+    and responses for missing files are never cached.
+    """
+    def __init__(self, capacity, metrics):
+        self.capacity = capacity  # Maximum total bytes of cached responses.
+        self.metrics = metrics  # Metrics the hit, miss and eviction counts are also reported to.
+        self.size = 0  # Current total bytes of cached responses.
+        self.entries = OrderedDict()  # Key -> CacheEntry, least recently used first.
+        self.lock = allocate_lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, resolve, build):
+        """
+        Provides the response for a key, building and caching it if it is absent or out of
+        date.
+        :param key: the (request path, content coding) tuple identifying the response.
+        :param resolve: function mapping a key to a (status, file name) tuple.
+        :param build: function taking a key, status, file name and stat result and returning
+        a Reply.
+        :return: the Reply.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)  # Mark most recently used.
+        now = monotonic()
+        if entry is not None and now - entry.checked < CACHE_REVALIDATE_INTERVAL:
+            self.record('hits')
+            return entry.reply
+        status, file_name = resolve(key)
+        info = os.stat(file_name)
+        if entry is not None and (entry.status, entry.file_name, entry.mtime, entry.size) == \
+                (status, file_name, info.st_mtime_ns, info.st_size):  # Unchanged on disk.
+            entry.checked = now
+            self.record('hits')
+            return entry.reply
+        self.record('misses')
+        reply = build(key, status, file_name, info)
+        if reply.file_name is not None:  # Streamed from disk, nothing worth caching.
+            return reply
+        if not status.startswith('200'):  # Missing file, distinct paths would flood the cache.
+            return reply
+        self.store(key, CacheEntry(status, file_name, info.st_mtime_ns, info.st_size, now, reply))
+        return reply
+
+    def store(self, key, entry):
+        """
+        Adds (or replaces) an entry, evicting the least recently used entries to stay within
+        capacity. Responses larger than the whole cache are not stored.
+        :param key: the (request path, content coding) tuple identifying the response.
+        :param entry: the CacheEntry to store.
+        :return: None
+        """
+        if entry.reply.size() > self.capacity:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.reply.size()
+            while self.entries and self.size + entry.reply.size() > self.capacity:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.reply.size()
+                self.evictions += 1
+                self.metrics.add('http_cache_evictions_total')
+            self.entries[key] = entry
+            self.size += entry.reply.size()
+            self.metrics.set('http_cache_bytes', self.size)
+
+    def record(self, counter):
+        """
+        Increments one of the hit/miss counters.
+        :param counter: the name of the counter attribute.
+        :return: None
+        """
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        self.metrics.add('http_cache_{}_total'.format(counter))
+
+    def stats(self):
+        """
+        Provides a snapshot of the cache statistics.
+        :return: a dictionary of hits, misses, evictions, entries and size (bytes).
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'size': self.size}
+
+
+class AsyncClient(object):
+    """
+    The per-connection state kept by the event loop engine in place of a thread stack.
+    """
+    __slots__ = ('connection', 'parser', 'outbound', 'file', 'offset', 'remaining', 'served',
+                 'closing', 'last_active', 'deadline')
+
+    def __init__(self, connection):
+        self.connection = connection  # Non-blocking client socket.
+        self.parser = RequestParser()  # Requests received but not yet replied to.
+        self.outbound = bytearray()  # Reply bytes not yet accepted by the kernel.
+        self.file = None  # File being streamed after outbound, if any.
+        self.offset = 0  # Next byte of file to stream.
+        self.remaining = 0  # Bytes of file still to stream.
+        self.served = 0  # Requests replied to on this connection.
+        self.closing = False  # True once the final reply has been queued.
+        self.last_active = 0.0  # Monotonic time of the last activity, for idle expiry.
+        self.deadline = None  # Monotonic time a partly received request must be complete by.
+
+
+def format_header(status, content_type, length, etag=None, modified=None, extra_headers=()):
+    """
+    Formats a response header (less the Connection header, see Reply.head).
+    :param status: the status line, e.g. '200 OK'.
+    :param content_type: the MIME type of the body, or None to omit entity headers (304s).
+    :param length: the length of the body in bytes.
+    :param etag: the entity tag of the served file, if it may be revalidated.
+    :param modified: the modification time (seconds) of the served file, if it has an etag.
+    :param extra_headers: [(name, value), ...] further headers, e.g. Content-Encoding.
+    :return: the header as bytes.
+    """
+    if content_type is None:
+        header = 'HTTP/1.1 {}'.format(status) + CRLF
+    else:
+        header = HTML_HEADER_FORMAT.format(status, content_type, length)
+    if etag is not None:
+        header += HEADER_LINE_FORMAT.format('ETag', etag)
+        header += HEADER_LINE_FORMAT.format('Last-Modified', formatdate(modified, usegmt=True))
+        header += HEADER_LINE_FORMAT.format('Accept-Ranges', 'bytes')
+    for name, value in extra_headers:
+        header += HEADER_LINE_FORMAT.format(name, value)
+    return header.encode()
+
+
+def is_compressible(content_type):
+    """
+    :param content_type: a MIME type, or None if unknown.
+    :return: True if bodies of the type are worth compressing.
+    """
+    return content_type is not None and \
+        (content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES)
+
+
+def compress_body(body, encoding):
+    """
+    :param body: the bytes to compress.
+    :param encoding: the content coding to apply, one of ENCODINGS.
+    :return: the compressed bytes.
+    """
+    if encoding == 'gzip':
+        return gzip_compress(body, COMPRESSION_LEVEL, mtime=0)  # Fixed mtime, stable output.
+    return zlib_compress(body, COMPRESSION_LEVEL)  # HTTP 'deflate' is the zlib format.
+
+
+def error_reply(status):
+    """
+    Builds an empty-bodied reply for an error status.
+    :param status: the status line, e.g. '400 Bad Request'.
+    :return: a Reply.
+    """
+    return Reply(format_header(status, 'text/html', 0))
+
+
+def send_file_chunk(connection, file, offset, count):
+    """
+    Sends up to STREAM_CHUNK bytes of a file directly to a socket without copying them through
+    Python objects, using sendfile(2) where available and a memory mapped view otherwise.
+    :param connection: the (blocking or non-blocking) socket to send on.
+    :param file: the open (binary) file to send from.
+    :param offset: the position in the file to start from.
+    :param count: the most bytes to send.
+    :return: the number of bytes sent, 0 if the file ends before offset.
+    """
+    count = min(count, STREAM_CHUNK)
+    if hasattr(os, 'sendfile'):
+        return os.sendfile(connection.fileno(), file.fileno(), offset, count)
+    try:
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as mapping, memoryview(mapping) as view:
+            return connection.send(view[offset:offset + count])
+    except ValueError:  # Empty file (cannot be mapped).
+        return 0
+
+
+def set_send_timeout(connection, seconds):
+    """
+    Limits how long a send on a blocking socket may stall (SO_SNDTIMEO), after which it fails
+    with BlockingIOError. Unlike settimeout this leaves the socket blocking, as sendfile needs.
+    :param connection: the socket.
+    :param seconds: the timeout (whole seconds).
+    :return: None
+    """
+    try:
+        connection.setsockopt(SOL_SOCKET, sockets.SO_SNDTIMEO, pack('ll', seconds, 0))
+    except (AttributeError, OSError):  # Not supported here, sends may block indefinitely.
+        pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,226 @@
+"""
+Author: Nicholas Lambourne
+CSE 3300  - Computer Networks and Data Communication
+Professor: Dr Bing Wang
+Assignment 1: Jumble Dictionary
+
+Compiles the jumble word list into a binary dictionary file which is opened with mmap, so
+startup needs no parsing and every process using the dictionary shares the same page cache
+pages. The file holds (little endian, offsets relative to the start of the file):
+    header      magic, version and the number of buckets, anagram classes and hash slots.
+    buckets     (length, plain, unique, offset, count) for each group of words dealt together.
+    classes     (offset, count, length) for each set of words sharing the same letters.
+    slots       open addressing hash table of class number + 1 (0 is empty), by signature.
+    words       the packed words of every bucket, then of every class.
+"""
+
+from mmap import mmap, ACCESS_READ
+from os import getpid, replace, stat
+from random import randrange
+from struct import Struct
+from sys import argv, exit
+from zlib import crc32
+
+MAGIC = b'JUMBLDIC'
+VERSION = 1
+HEADER = Struct('<8sIIII')  # Magic, version, bucket count, class count, slot count.
+BUCKET = Struct('<HBBII')  # Word length, plain, unique, words offset, word count.
+CLASS = Struct('<IHH')  # Words offset, word count, word length.
+SLOT = Struct('<I')  # Class number + 1, 0 for an empty slot.
+
+
+def signature(word):
+    """
+    :param word: a word (bytes).
+    :return: the word's letters in sorted order (bytes), shared by all of its anagrams.
+    """
+    return bytes(sorted(word))
+
+
+def compile_dictionary(source, target):
+    """
+    Compiles a word list (one word per line) into a dictionary file. The file is written
+    under a temporary name and moved into place, so processes compiling at the same time
+    never see a partial file.
+    :param source: the path of the word list.
+    :param target: the path of the dictionary file to create.
+    :return: None
+    """
+    with open(source, 'rb') as file:
+        lines = file.read().split(b'\n')
+    anagrams = {}
+    for line in lines:
+        word = line.strip()
+        if word:
+            anagrams.setdefault(signature(word), bytearray()).extend(word)
+    buckets = {}
+    for key, packed in anagrams.items():
+        length = len(key)
+        unique = len(packed) == length and len(set(key)) > 1  # One word, can be jumbled.
+        for start in range(0, len(packed), length):
+            word = packed[start:start + length]
+            buckets.setdefault((length, word.isalpha(), unique), bytearray()).extend(word)
+    slot_count = 1
+    while slot_count < 2 * len(anagrams):  # At most half full, keeps probe sequences short.
+        slot_count *= 2
+    offset = HEADER.size + BUCKET.size * len(buckets) + CLASS.size * len(anagrams) + \
+        SLOT.size * slot_count
+    table, words = bytearray(), bytearray()
+    for (length, plain, unique), packed in sorted(buckets.items()):
+        table += BUCKET.pack(length, plain, unique, offset + len(words), len(packed) // length)
+        words += packed
+    slots = [0] * slot_count
+    for number, (key, packed) in enumerate(sorted(anagrams.items())):
+        table += CLASS.pack(offset + len(words), len(packed) // len(key), len(key))
+        words += packed
+        slot = crc32(key) & (slot_count - 1)
+        while slots[slot]:  # Linear probing.
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = number + 1
+    temporary = '{}.{}'.format(target, getpid())
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(buckets), len(anagrams), slot_count))
+        file.write(table)
+        file.write(b''.join(SLOT.pack(slot) for slot in slots))
+        file.write(words)
+    replace(temporary, target)
+
+
+def open_dictionary(source, target):
+    """
+    Opens the dictionary compiled from a word list, (re)compiling it first if it is missing
+    or older than the word list.
+    :param source: the path of the word list.
+    :param target: the path of the compiled dictionary file.
+    :return: a Dictionary.
+    """
+    try:
+        stale = stat(target).st_mtime_ns < stat(source).st_mtime_ns
+    except FileNotFoundError:
+        stale = True
+    if stale:
+        compile_dictionary(source, target)
+    return Dictionary(target)
+
+
+class Dictionary(object):
+    """
+    A compiled dictionary file, memory mapped read only. Words matching a game's criteria are
+    chosen with a single random draw, and any valid answer to a jumble is recognised with one
+    hash table lookup, without the words ever being loaded into Python objects.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap(file.fileno(), 0, access=ACCESS_READ)  # Stays valid once closed.
+        magic, version, bucket_count, self.class_count, self.slot_count = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version {} dictionary file: {}'.format(VERSION, path))
+        self.classes_offset = HEADER.size + BUCKET.size * bucket_count
+        self.slots_offset = self.classes_offset + CLASS.size * self.class_count
+        self.buckets = [BUCKET.unpack_from(self.data, HEADER.size + BUCKET.size * index)
+                        for index in range(bucket_count)]
+        lengths = [length for length, _, _, _, _ in self.buckets] or [0]
+        self.shortest, self.longest = min(lengths), max(lengths)  # Word lengths present.
+        # Criteria -> [(count, length, offset), ...], built on demand. Lengths are clamped to
+        # those present first, so clients choosing arbitrary ranges cannot grow it unbounded.
+        self.selections = {}
+
+    def select(self, min_length, max_length, all_words, unique_only):
+        """
+        Provides the buckets holding words matching the given criteria.
+        :param min_length: the shortest acceptable word length.
+        :param max_length: the longest acceptable word length.
+        :param all_words: if true words with punctuation are acceptable, otherwise only plain ones.
+        :param unique_only: if true only words that are the sole anagram of their letters (and
+        so have exactly one answer) are acceptable.
+        :return: [(count, length, words offset), ...] list of matching buckets.
+        """
+        min_length, max_length = max(min_length, self.shortest), min(max_length, self.longest)
+        if min_length > max_length:  # No word fits, every such range shares one entry.
+            min_length, max_length = self.longest + 1, self.longest
+        criteria = (min_length, max_length, bool(all_words), bool(unique_only))
+        selection = self.selections.get(criteria)
+        if selection is None:
+            selection = [(count, length, offset)
+                         for length, plain, unique, offset, count in self.buckets
+                         if min_length <= length <= max_length and (plain or all_words) and
+                         (unique or not unique_only)]
+            self.selections[criteria] = selection
+        return selection
+
+    def count(self, min_length, max_length, all_words, unique_only):
+        """
+        :return: the number of words matching the criteria (as for select).
+        """
+        return sum(count for count, _, _ in self.select(min_length, max_length, all_words,
+                                                        unique_only))
+
+    def choose(self, min_length, max_length, all_words, unique_only):
+        """
+        Chooses a word uniformly at random from those matching the criteria (as for select).
+        N.B. Raises ValueError if no words match.
+        :return: the word (string).
+        """
+        index = randrange(self.count(min_length, max_length, all_words, unique_only))
+        for count, length, offset in self.select(min_length, max_length, all_words, unique_only):
+            if index < count:
+                start = offset + index * length
+                return self.data[start:start + length].decode('latin-1')
+            index -= count
+
+    def anagrams(self, key):
+        """
+        Looks up the words spelt with a set of letters.
+        :param key: the signature (sorted letters, bytes) to look up.
+        :return: the matching words packed back to back (bytes), empty if there are none.
+        """
+        mask = self.slot_count - 1
+        slot = crc32(key) & mask
+        while True:
+            number, = SLOT.unpack_from(self.data, self.slots_offset + SLOT.size * slot)
+            if not number:
+                return b''
+            offset, count, length = CLASS.unpack_from(
+                self.data, self.classes_offset + CLASS.size * (number - 1))
+            if length == len(key) and signature(self.data[offset:offset + length]) == key:
+                return self.data[offset:offset + count * length]
+            slot = (slot + 1) & mask
+
+    def unjumble(self, letters):
+        """
+        Solves a jumble.
+        :param letters: the jumbled letters (string).
+        :return: a dictionary word spelt with exactly those letters (string), or None if
+        there is none.
+        """
+        key = signature(letters.encode('latin-1', 'replace'))
+        packed = self.anagrams(key)
+        return packed[:len(key)].decode('latin-1') if packed else None
+
+    def is_anagram(self, guess, word):
+        """
+        Tests whether a guess is a correct answer for a word's jumble, i.e. it is a word in
+        the dictionary spelt with exactly the same letters.
+        :param guess: the player's guess (string).
+        :param word: the word that was jumbled (string).
+        :return: True if the guess is correct, otherwise False.
+        """
+        if len(guess) != len(word):
+            return False
+        encoded = guess.encode('latin-1', 'replace')
+        key = signature(encoded)
+        if key != signature(word.encode('latin-1')):
+            return False
+        packed = self.anagrams(key)
+        return any(packed[start:start + len(key)] == encoded
+                   for start in range(0, len(packed), len(key)))
+
+
+if __name__ == '__main__':
+    if len(argv) != 3:
+        print('Incorrect number of arguments!\n'
+              'Usage: python3 dictionary.py <word_list> <dictionary_file>')
+        exit(1)
+    compile_dictionary(argv[1], argv[2])
+    print('Compiled {} into {}'.format(argv[1], argv[2]))
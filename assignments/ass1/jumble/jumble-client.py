@@ -5,10 +5,29 @@ Professor: Dr Bing Wang
 Assignment 1: Jumble Client
 """
 
-from time import sleep
+from heapq import heappush, heappop
+from random import uniform
+from errno import EINPROGRESS
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
 from signal import signal, SIGINT
 from sys import argv, exit
-from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_ERROR, SO_REUSEADDR
+from time import perf_counter
+from dictionary import open_dictionary
+from protocol import encode_message, receive_message, FrameDecoder, MAX_MESSAGE, RECV_SIZE
+
+WORD_LIST_FILE = 'wordlist.txt'
+DICTIONARY_FILE = 'wordlist.dict'  # Compiled from WORD_LIST_FILE, as by the server.
+DEFAULT_OPTIONS = {
+    'bots': 0,  # Simulated players to run in bot mode, 0 to play interactively.
+    'think': 1.0,  # Mean seconds each bot waits between receiving a jumble and guessing.
+    'duration': 10.0,  # Seconds to run bot mode for.
+    'timeout': 10.0,  # Seconds a bot waits for a reply before counting an error.
+    'min-length': 0,  # Word length range requested with START, 0 for the server's defaults.
+    'max-length': 0,
+}
+RECONNECT_DELAY = 1.0  # Seconds before a bot that lost its connection reconnects.
+PERCENTILES = [50, 90, 99, 99.9]
 
 
 class JumbleClient(object):
@@ -17,24 +36,46 @@ class JumbleClient(object):
     playing the game jumble continuously until interrupted.
     """
     def __init__(self):
-        self.server_address, self.port = self.parse_arguments()
-        self.sock = self.start_connection()  # socket.socket object for communication with server
+        self.server_address, self.port, self.options = self.parse_arguments()
+        self.sock = None  # socket.socket object for communication with server
+        if not self.options['bots']:  # Bots make their own connections.
+            self.sock = self.start_connection()
+        self.decoder = FrameDecoder()  # Messages are framed, see protocol.py.
 
     def play_game(self):
         """
         Starts a game with an already connected server.
         :return: None
         """
-        self.sock.send('START'.encode())
-        while True:
-            data = self.sock.recv(1024)
-            message = data.decode()
-            if message == "":
-                print("Connection closed.")
-                exit(0)
-            elif message == "ACCEPTED":
-                self.game_loop()
-            sleep(1)
+        self.sock.sendall(encode_message(self.start_message()))
+        message = self.receive()
+        if message == "ACCEPTED":
+            self.game_loop()
+        print("Unexpected reply from server: " + message)
+        exit(4)
+
+    def start_message(self):
+        """
+        :return: the message starting a game with the configured word lengths (string).
+        """
+        if self.options['min-length'] and self.options['max-length']:
+            return 'START {} {}'.format(self.options['min-length'], self.options['max-length'])
+        return 'START'
+
+    def receive(self):
+        """
+        Waits for the next message from the server.
+        N.B. Will exit if the connection is lost.
+        :return: the message (string).
+        """
+        try:
+            message = receive_message(self.sock, self.decoder)
+        except (OSError, ValueError):  # Connection lost or invalid frame.
+            message = None
+        if message is None:
+            print("Connection to server lost, shutting down...")
+            exit(4)
+        return message
 
     def start_connection(self):
         """
@@ -50,29 +91,50 @@ class JumbleClient(object):
 
     def parse_arguments(self):
         """
-        Parses the command line arguments and returns the values as a tuple.
-        Will cause the process to exit if an invalid number of arguments or port number are provided.
-        :return: A tuple representing the server address and a port number for connection.
+        Parses the command line arguments and returns the values as a tuple. Optional settings
+        are given after the port in the form --name=value.
+        Will cause the process to exit if an invalid number of arguments, port number or
+        option is provided.
+        :return: A tuple representing the server address, a port number for connection and
+        the options {string: int/float}.
         """
+        arguments = [argument for argument in argv[1:] if not argument.startswith('--')]
         # Check the number of command line arguments
-        if len(argv) not in [2, 3]:
+        if len(arguments) not in [1, 2]:
             print('Client startup failed!\n'
                   'Incorrect number of arguments\n'
-                  'Usage: python3 jumble-client.py <server-address> [port]')
+                  'Usage: python3 jumble-client.py <server-address> [port] [options...]')
             exit(1)
 
-        server_address = argv[1].strip()
+        server_address = arguments[0].strip()
         port = 80  # Default to port 80 (HTTP) if no port is provided.
-        try:
-            port = int(argv[2])
-            if port < 5000:
+        if len(arguments) == 2:
+            try:
+                port = int(arguments[1])
+                if port < 5000:
+                    print('Client startup failed!\n'
+                          'Port must be >5000 to avoid clashes with critical ports')
+                    exit(2)
+            except ValueError:
                 print('Client startup failed!\n'
-                      'Port must be >5000 to avoid clashes with critical ports')
+                      'Port provided was not an integer!')
                 exit(2)
-        except TypeError:
-            print('Client startup failed!\n'
-                  'Port provided was not an integer!')
-        return server_address, port
+        options = dict(DEFAULT_OPTIONS)
+        for argument in argv[1:]:
+            if not argument.startswith('--'):
+                continue
+            name, _, value = argument[2:].partition('=')
+            try:
+                if name not in options:
+                    raise ValueError(name)
+                options[name] = type(DEFAULT_OPTIONS[name])(value)
+                if options[name] < 0:
+                    raise ValueError(value)
+            except ValueError:
+                print('Client startup failed!\n'
+                      'Invalid option: ' + argument)
+                exit(5)
+        return server_address, port, options
 
     def game_loop(self):
         """
@@ -81,20 +143,19 @@ class JumbleClient(object):
         :return: None
         """
         while True:
+            jumble = self.receive().strip()  # Arrives with the previous verdict.
+            guess = input("Jumble: " + jumble + "\nGuess: ")
             try:
-                word_enc = self.sock.recv(1024)
-                word_dec = word_enc.decode().strip()
-                guess = input("Jumble: " + word_dec + "\nGuess: ")
-                self.sock.send(guess.encode())
-                correct = self.sock.recv(1024)
-                if correct.decode() == "YES":
-                    print("You win.")
-                else:
-                    correct = correct.decode()
-                    print("The answer is ", correct)
-            except BrokenPipeError:
+                # Characters encode to at most 4 bytes, keep within the frame limit.
+                self.sock.sendall(encode_message(guess[:MAX_MESSAGE // 4]))
+            except OSError:
                 print("Connection to server lost, shutting down...")
                 exit(4)
+            correct = self.receive()
+            if correct == "YES":
+                print("You win.")
+            else:
+                print("The answer is ", correct)
 
 
     def graceful_shutdown(self, signum, frame):
@@ -109,24 +170,241 @@ class JumbleClient(object):
         exit(3)
 
 
-if __name__ == '__main__':
-    client = JumbleClient()  # Instantiate client.
-    signal(SIGINT, client.graceful_shutdown)  # Set up Keyboard Interrupt handling.
-    client.play_game()  # Start game loop.
-
+class BotSwarm(object):
+    """
+    Soak tests a server with simulated players, all driven from one thread over a selector.
+    Each bot solves its jumbles from the dictionary and guesses after a random think time
+    around the configured mean, reconnecting if it loses its connection. Reports the rounds
+    played per second, the latency of each turn and the error counts.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.words = open_dictionary(WORD_LIST_FILE, DICTIONARY_FILE)
+        self.start_frame = encode_message(client.start_message())
+        self.think = client.options['think']
+        self.timeout = client.options['timeout']
+        self.selector = DefaultSelector()
+        self.timers = []  # Heap of (time, sequence, action, bot, turn) for bots waiting on a time.
+        self.sequence = 0  # Tie break for timers due at the same time.
+        self.latencies = []  # Seconds from each guess being due to its reply, one per round.
+        self.errors = {'connect': 0, 'disconnect': 0, 'timeout': 0, 'protocol': 0,
+                       'wrong': 0, 'unsolved': 0}
 
+    def run(self):
+        """
+        Runs the bots for the configured duration (or until interrupted) and prints the report.
+        :return: None
+        """
+        bots = self.client.options['bots']
+        print('Running {} bots against {}:{} for {:g}s with {:g}s think time...'.format(
+            bots, self.client.server_address, self.client.port, self.client.options['duration'],
+            self.think))
+        start = perf_counter()
+        end = start + self.client.options['duration']
+        try:
+            for _ in range(bots):
+                self.connect(Bot())
+            while True:
+                now = perf_counter()
+                while self.timers and self.timers[0][0] <= now:
+                    _, _, action, bot, turn = heappop(self.timers)
+                    if turn == bot.turn:  # Otherwise the bot has moved on since.
+                        action(bot)
+                if now >= end:
+                    break
+                wait = min(end, self.timers[0][0] if self.timers else end) - now
+                for key, _ in self.selector.select(max(wait, 0)):
+                    if key.events & EVENT_WRITE:  # Still connecting.
+                        self.start(key.data)
+                    else:
+                        self.receive(key.data)
+        except KeyboardInterrupt:
+            print('\nReceived interrupt: Stopping early...')
+        elapsed = perf_counter() - start
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.report(elapsed)
 
+    def schedule(self, delay, action, bot):
+        """
+        Arranges for an action to be taken for a bot after a delay, unless it moves on first.
+        :param delay: seconds from now.
+        :param action: the method to call with the bot.
+        :param bot: the Bot.
+        :return: the time (perf_counter) the action is due.
+        """
+        due = perf_counter() + delay
+        self.sequence += 1
+        heappush(self.timers, (due, self.sequence, action, bot, bot.turn))
+        return due
 
+    def connect(self, bot):
+        """
+        Begins connecting a bot to the server without waiting, so a slow or unreachable server
+        does not hold up the other bots. Its game is started once the socket becomes writable
+        (see start), or the attempt is abandoned after the timeout.
+        :param bot: the Bot to connect.
+        :return: None
+        """
+        bot.turn += 1
+        bot.sock = socket(AF_INET, SOCK_STREAM)
+        bot.sock.setblocking(False)
+        error = bot.sock.connect_ex((self.client.server_address, self.client.port))
+        if error not in (0, EINPROGRESS):
+            self.errors['connect'] += 1
+            bot.sock.close()
+            self.schedule(RECONNECT_DELAY, self.connect, bot)
+            return
+        self.selector.register(bot.sock, EVENT_WRITE, bot)
+        self.schedule(self.timeout, self.abandon, bot)
 
+    def start(self, bot):
+        """
+        Starts a bot's game once its connection attempt has finished, if it succeeded.
+        :param bot: the Bot whose socket has become writable.
+        :return: None
+        """
+        try:
+            error = bot.sock.getsockopt(SOL_SOCKET, SO_ERROR)
+            if error:
+                raise ConnectionRefusedError(error)
+            bot.sock.send(self.start_frame)  # Tiny, fits in a new socket's buffer.
+        except OSError:
+            self.drop(bot, 'connect')
+            return
+        bot.decoder = FrameDecoder()
+        bot.answer, bot.due, bot.jumble_next = None, None, False
+        bot.turn += 1  # Cancels the connect timeout.
+        self.selector.modify(bot.sock, EVENT_READ, bot)
+        self.schedule(self.timeout, self.expire, bot)
 
+    def drop(self, bot, error):
+        """
+        Closes a bot's connection after an error, counting it, and arranges for it to reconnect.
+        :param bot: the Bot.
+        :param error: the kind of error (key of errors).
+        :return: None
+        """
+        self.errors[error] += 1
+        self.selector.unregister(bot.sock)
+        bot.sock.close()
+        bot.turn += 1  # Cancels any pending timers.
+        self.schedule(RECONNECT_DELAY, self.connect, bot)
 
+    def abandon(self, bot):
+        """
+        Timer action, a bot's connection attempt has not finished within the timeout.
+        :param bot: the Bot.
+        :return: None
+        """
+        self.drop(bot, 'connect')
 
+    def expire(self, bot):
+        """
+        Timer action, the server has not replied to a bot within the timeout.
+        :param bot: the Bot.
+        :return: None
+        """
+        self.drop(bot, 'timeout')
 
+    def guess(self, bot):
+        """
+        Timer action, a bot has finished thinking and sends its answer.
+        :param bot: the Bot.
+        :return: None
+        """
+        try:
+            bot.sock.send(encode_message(bot.answer))  # Tiny, fits in an idle socket's buffer.
+        except OSError:
+            self.drop(bot, 'disconnect')
+            return
+        bot.turn += 1
+        self.schedule(self.timeout, self.expire, bot)
 
+    def receive(self, bot):
+        """
+        Handles the messages received by a bot: a verdict (or ACCEPTED), then the next jumble.
+        :param bot: the Bot with data to read.
+        :return: None
+        """
+        try:
+            data = bot.sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionResetError()
+            bot.decoder.feed(data)
+            message = bot.decoder.next_message()
+            while message is not None:
+                if bot.jumble_next:
+                    self.play(bot, message)
+                elif bot.due is None and message != 'ACCEPTED':  # Reply to START.
+                    self.drop(bot, 'protocol')
+                    return
+                elif bot.due is not None and message != 'YES':
+                    self.errors['wrong'] += 1
+                bot.jumble_next = not bot.jumble_next
+                message = bot.decoder.next_message()
+        except ValueError:
+            self.drop(bot, 'protocol')
+        except OSError:
+            self.drop(bot, 'disconnect')
 
+    def play(self, bot, jumble):
+        """
+        Completes a bot's turn on receiving its next jumble, solving it and arranging the guess.
+        :param bot: the Bot.
+        :param jumble: the jumble received (string, space separated letters).
+        :return: None
+        """
+        if bot.due is not None:  # Latency from when the guess was due (coordinated omission).
+            self.latencies.append(perf_counter() - bot.due)
+        letters = ''.join(jumble.split())
+        bot.answer = self.words.unjumble(letters)
+        if bot.answer is None:  # Not a dictionary word, guess the letters as dealt.
+            self.errors['unsolved'] += 1
+            bot.answer = letters
+        bot.turn += 1
+        bot.due = self.schedule(uniform(0.5, 1.5) * self.think, self.guess, bot)
 
+    def report(self, elapsed):
+        """
+        Prints the rounds played per second, error counts and turn latency percentiles.
+        :param elapsed: the duration of the run in seconds.
+        :return: None
+        """
+        latencies = sorted(self.latencies)
+        rounds = len(latencies)
+        print('Completed {} rounds in {:.3f}s: {:.1f} rounds/s, {} correct'.format(
+            rounds, elapsed, rounds / elapsed, rounds - self.errors['wrong']))
+        print('Errors: {} ({})'.format(
+            sum(self.errors.values()),
+            ', '.join('{} {}'.format(kind, count) for kind, count in self.errors.items())))
+        if not latencies:
+            return
+        print('Turn latency (ms): min {:.3f}, mean {:.3f}, max {:.3f}'.format(
+            latencies[0] * 1e3, sum(latencies) / rounds * 1e3, latencies[-1] * 1e3))
+        print('  ' + ', '.join('p{:g} {:.3f}'.format(percentile, 1e3 * latencies[
+            min(int(rounds * percentile / 100), rounds - 1)]) for percentile in PERCENTILES))
 
 
+class Bot(object):
+    """
+    The state of one simulated player in a BotSwarm.
+    """
+    __slots__ = ('sock', 'decoder', 'answer', 'due', 'jumble_next', 'turn')
 
+    def __init__(self):
+        self.sock = None  # Non-blocking connection to the server.
+        self.decoder = None  # FrameDecoder for the connection.
+        self.answer = None  # Solution to the current jumble, to be guessed.
+        self.due = None  # Time (perf_counter) the last guess was due, None before the first.
+        self.jumble_next = False  # True when the next message is a jumble, not a verdict.
+        self.turn = 0  # Incremented on every step, timers for earlier turns are ignored.
 
 
+if __name__ == '__main__':
+    client = JumbleClient()  # Instantiate client.
+    if client.options['bots']:  # Soak test, interrupt stops early and still reports.
+        BotSwarm(client).run()
+        exit(0)
+    signal(SIGINT, client.graceful_shutdown)  # Set up Keyboard Interrupt handling.
+    client.play_game()  # Start game loop.
@@ -5,15 +5,60 @@ Professor: Dr Bing Wang
 Assignment 1: Jumble Server
 """
 
+from collections import OrderedDict
+from logging import getLogger
+from os import fork, kill, waitpid
+from os.path import abspath, dirname
 from signal import signal, SIGINT
-from random import randrange, shuffle
+from random import shuffle
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
 from socket import gethostbyname, socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
-from sys import argv, exit
-from time import ctime, time
+from sys import argv, exit, path as search_path, stdout
+from time import monotonic, perf_counter, sleep
 from _thread import start_new_thread
+from queue import Queue, Full
+search_path.insert(0, dirname(dirname(abspath(__file__))))  # Finds server_common (ass1).
+from server_common import AsyncLogHandler, ConnectionRegistry, Metrics, raise_file_limit, \
+    serve_metrics, shutdown_connection
+from dictionary import open_dictionary
+from protocol import encode_messages, receive_message, FrameDecoder, RECV_SIZE
 
 DEFAULT_PORT = 50007
 WORD_LIST_FILE = 'wordlist.txt'
+DICTIONARY_FILE = 'wordlist.dict'  # Compiled from WORD_LIST_FILE whenever it is out of date.
+ENGINES = ['thread', 'async']  # Available serving engines, first is the default.
+DEFAULT_OPTIONS = {
+    'engine': ENGINES[0],  # thread: a pool thread per game, async: every game on one selector.
+    'workers': 64,  # Threads (thread engine) hosting games, i.e. the most games played at once.
+    'queue': 64,  # Accepted players allowed to wait for a free worker before being turned away.
+    'backlog': 128,  # Pending (not yet accepted) connections held by the kernel.
+    'min-length': 1,  # Default shortest word dealt (games may choose their own range).
+    'max-length': 4,  # Default longest word dealt.
+    'all-words': 0,  # 1 to also deal words with punctuation (e.g. a-ok), 0 for plain a-z only.
+    'unique-only': 0,  # 1 to only deal words that are the sole anagram of their letters.
+    'processes': 1,  # Server processes accepting on the port, all sharing the one dictionary.
+    'idle-timeout': 300,  # Seconds a player may take to start or make a guess.
+    'drain-timeout': 10,  # Seconds shutdown waits for turns in progress to finish.
+    'admin-port': 0,  # Port serving /metrics to the local host, 0 to disable.
+    'log-level': 'info',  # Least severe events logged: debug (every connection), info, ...
+}
+FLAG_OPTIONS = ['all-words', 'unique-only', 'admin-port']  # Options which may be 0.
+LOG_LEVELS = ['debug', 'info', 'warning', 'error']
+CHOICES = {'engine': ENGINES, 'log-level': LOG_LEVELS}  # Options taking one of a set of names.
+METRICS = [  # (name, type, help) of each value exposed on the admin port.
+    ('jumble_connections_accepted_total', 'counter', 'Players accepted.'),
+    ('jumble_connections_rejected_total', 'counter', 'Players turned away while full.'),
+    ('jumble_players_active', 'gauge', 'Players currently connected.'),
+    ('jumble_rounds_total', 'counter', 'Guesses judged.'),
+    ('jumble_rounds_won_total', 'counter', 'Guesses judged correct.'),
+    ('jumble_sent_bytes_total', 'counter', 'Bytes of messages sent to players.'),
+]
+LATENCY_METRIC = ('jumble_turn_duration_seconds', 'Seconds from a guess being received to the '
+                  'verdict and next jumble being sent (thread engine) or queued (async engine).')
+LATENCY_BUCKETS = [0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25]  # Upper bounds (seconds) of the latency histogram buckets.
+DRAIN_POLL = 0.05  # Seconds between checks on connections still draining at shutdown.
+ADMIN_HOST = '127.0.0.1'  # The admin port is only served to the local host.
 
 
 class JumbleServer(object):
@@ -23,9 +68,18 @@ class JumbleServer(object):
     """
     def __init__(self):
         self.words = self.get_word_list()  # Populate list of words
-        self.port = self.parse_arguments()  # Port to host on (from command line or default)
+        self.port, self.options = self.parse_arguments()  # From command line or default
         self.host = ''  # Equivalent to localhost / 0.0.0.0
-        self.connections = []  # For storing connection objects (in case of interrupt)
+        self.registry = ConnectionRegistry()  # Open player connections, closed ones removed.
+        self.listening = None  # The listening socket served by this process.
+        self.draining = False  # True once shutdown has begun, no further turns are started.
+        self.worker_processes = []  # Pids of the forked server processes (first process only).
+        # Shared by every server process, each reporting into its own slot.
+        self.metrics = Metrics(METRICS, LATENCY_METRIC, LATENCY_BUCKETS, self.options['processes'])
+        self.log_handler = AsyncLogHandler(stdout)
+        self.log = getLogger('jumble-server')
+        self.log.addHandler(self.log_handler)
+        self.log.setLevel(self.options['log-level'].upper())
 
     def start_server(self):
         """
@@ -36,50 +90,290 @@ class JumbleServer(object):
         sock = socket(AF_INET, SOCK_STREAM)  # TCP, IPV4
         sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # Release socket immediately on program exit
         sock.bind((self.host, self.port))
-        sock.listen(10)  # 10 pending connections allowed
+        sock.listen(self.options['backlog'])
         print('Server started, (listening on {}:{}) waiting for connection...'.\
               format(gethostbyname(''), self.port))
+        for slot in range(1, self.options['processes']):  # Inherit the socket and dictionary map.
+            pid = fork()
+            if not pid:
+                self.worker_processes = []
+                self.metrics.use_slot(slot)
+                break
+            self.worker_processes.append(pid)
+        self.log_handler.start()  # Threads do not survive fork, so only start them now.
+        if self.metrics.base == 0:  # First process.
+            self.start_admin_server()
+        self.listening = sock
+        if self.options['engine'] == 'async':
+            self.run_event_loop(sock)
+        pending = Queue(self.options['queue'])  # Accepted players waiting for a worker.
+        for _ in range(self.options['workers']):  # Fixed pool, no thread is spawned per client.
+            start_new_thread(self.run_worker, (pending,))
         while True:
             connection, address = sock.accept()
-            self.connections.append(connection)
-            print('Server connected to {} at {}'.format(address, ctime(time())))
-            start_new_thread(self.handle_client, (connection,))
+            self.registry.add(connection)
+            self.metrics.add('jumble_connections_accepted_total')
+            self.log.debug('Server connected to %s', address)
+            try:
+                pending.put_nowait(connection)
+            except Full:  # Every game slot taken and queue full, turn the player away.
+                self.log.warning('Server full, closing connection to %s', address)
+                self.metrics.add('jumble_connections_rejected_total')
+                connection.close()
+                self.registry.remove(connection)
+
+    def run_worker(self, pending):
+        """
+        Body of each pool thread: hosts queued players one at a time, forever.
+        :param pending: the Queue of accepted client connections.
+        :return: None
+        """
+        while True:
+            connection = pending.get()
+            self.metrics.add('jumble_players_active')
+            try:
+                self.handle_client(connection)
+            except Exception as error:  # Never let one bad client take a worker down with it.
+                self.log.error('Client handler failed: %s', error)
+                connection.close()
+            self.registry.remove(connection)
+            self.metrics.add('jumble_players_active', -1)
+
+    def start_admin_server(self):
+        """
+        Starts a thread answering GET /metrics on the admin port (if one is configured) with
+        the server's metrics, summed over every process, in the Prometheus text format.
+        :return: None
+        """
+        if self.options['admin-port']:
+            serve_metrics(ADMIN_HOST, self.options['admin-port'], self.metrics, self.log)
+
+    def run_event_loop(self, sock):
+        """
+        Hosts every game from a single thread, multiplexing the connections over one selector
+        (epoll/kqueue where available). A player thinking about a guess costs a registration
+        and a JumbleGame rather than a blocked thread, so tens of thousands may play at once.
+        N.B. Will run until explicitly interrupted.
+        :param sock: the bound and listening server socket.
+        :return: None
+        """
+        raise_file_limit()
+        selector = DefaultSelector()
+        sock.setblocking(False)
+        selector.register(sock, EVENT_READ)  # Listening socket is the only key without a game.
+        self.idle_games = OrderedDict()  # JumbleGame -> None, least recently active first.
+        deadline = None  # When draining must end, once shutdown has begun.
+        while True:
+            for key, events in selector.select(1.0):  # Wake at least every second to expire games.
+                if key.data is None:
+                    self.accept_games(selector, sock)
+                else:
+                    self.service_game(selector, key, events)
+            self.expire_idle_games(selector)
+            if self.draining:
+                if deadline is None:  # Interrupted since the last pass, stop accepting.
+                    deadline = monotonic() + self.options['drain-timeout']
+                    selector.unregister(sock)
+                    sock.close()
+                self.drain_event_loop(selector, deadline)
+
+    def drain_event_loop(self, selector, deadline):
+        """
+        Ends the event loop's games while the server is shutting down, leaving those with
+        replies still to send to finish, and exits once none are left or the deadline passes.
+        :param selector: the selector used by run_event_loop.
+        :param deadline: the monotonic time by which the server exits regardless.
+        :return: None
+        """
+        for game in list(self.idle_games):
+            if not game.outbound:
+                self.close_game(selector, game)
+        if not self.idle_games or monotonic() >= deadline:
+            self.finish_shutdown()
+
+    def accept_games(self, selector, sock):
+        """
+        Accepts every connection pending on the listening socket, starting a game for each.
+        :param selector: the selector used by run_event_loop.
+        :param sock: the non-blocking listening socket.
+        :return: None
+        """
+        while True:
+            try:
+                connection, address = sock.accept()
+            except (BlockingIOError, InterruptedError):  # Backlog drained.
+                return
+            except OSError as error:  # e.g. out of file descriptors, retry on next event.
+                self.log.error('Accept failed: %s', error)
+                return
+            connection.setblocking(False)
+            self.registry.add(connection)
+            self.metrics.add('jumble_connections_accepted_total')
+            self.metrics.add('jumble_players_active')
+            self.log.debug('Server connected to %s', address)
+            game = JumbleGame(connection)
+            selector.register(connection, EVENT_READ, game)
+            self.touch_game(game)
+
+    def service_game(self, selector, key, events):
+        """
+        Reads messages from and/or writes pending replies to a ready player, advancing its game
+        once for each complete message received (a player may send several at once).
+        :param selector: the selector used by run_event_loop.
+        :param key: the selector key of the ready connection, its data is the JumbleGame.
+        :param events: the selector event mask the connection is ready for.
+        :return: None
+        """
+        game = key.data
+        try:
+            if events & EVENT_READ:
+                data = game.connection.recv(RECV_SIZE)
+                if not data:  # Player closed its end.
+                    self.close_game(selector, game)
+                    return
+                game.decoder.feed(data)
+                message = game.decoder.next_message()
+                while message is not None:
+                    self.advance_game(game, message)
+                    message = game.decoder.next_message()
+            if game.outbound:
+                sent = game.connection.send(game.outbound)
+                self.metrics.add('jumble_sent_bytes_total', sent)
+                game.outbound = game.outbound[sent:]
+        except (BlockingIOError, InterruptedError):
+            pass  # Socket buffer full, wait for next event.
+        except (OSError, ValueError):  # Connection reset or invalid frame.
+            self.close_game(selector, game)
+            return
+        self.touch_game(game)
+        wanted = EVENT_WRITE if game.outbound else EVENT_READ
+        if key.events != wanted:  # Only touch the registration when it changes.
+            selector.modify(game.connection, wanted, game)
+
+    def advance_game(self, game, message):
+        """
+        Moves a game on by one message from its player, queueing the same replies as
+        handle_client and game_loop: ACCEPTED after the START message, then YES or the answer
+        after each guess, each framed together with the next jumble.
+        :param game: the JumbleGame the message was received for.
+        :param message: the message received from the player.
+        :return: None
+        """
+        started = perf_counter()
+        if game.word is None:  # Waiting for START.
+            game.min_length, game.max_length = self.parse_start(message)
+            verdict = 'ACCEPTED'
+        else:
+            game.rounds += 1
+            self.metrics.add('jumble_rounds_total')
+            if self.words.is_anagram(message.strip(), game.word):  # Any anagram is correct.
+                game.wins += 1
+                self.metrics.add('jumble_rounds_won_total')
+                verdict = 'YES'
+            else:
+                verdict = game.word  # Rejection (correct spelling).
+        game.word = self.get_word(self.words, game.min_length, game.max_length)
+        game.outbound += encode_messages(verdict, self.jumble_word(game.word))
+        if game.rounds:
+            self.metrics.observe(perf_counter() - started)
+
+    def close_game(self, selector, game):
+        """
+        Unregisters and closes the connection of a game hosted by the event loop.
+        :param selector: the selector used by run_event_loop.
+        :param game: the JumbleGame to end.
+        :return: None
+        """
+        selector.unregister(game.connection)
+        self.idle_games.pop(game, None)
+        game.connection.close()
+        self.registry.remove(game.connection)
+        self.metrics.add('jumble_players_active', -1)
+        self.log.debug('Connection closed.')
+
+    def touch_game(self, game):
+        """
+        Records activity in a game, postponing its idle expiry.
+        :param game: the JumbleGame.
+        :return: None
+        """
+        game.last_active = monotonic()
+        self.idle_games[game] = None
+        self.idle_games.move_to_end(game)
+
+    def expire_idle_games(self, selector):
+        """
+        Ends games whose player has been inactive for longer than the idle timeout. Only the
+        expired games (at the front of idle_games) are visited.
+        :param selector: the selector used by run_event_loop.
+        :return: None
+        """
+        deadline = monotonic() - self.options['idle-timeout']
+        while self.idle_games:
+            game = next(iter(self.idle_games))
+            if game.last_active > deadline:
+                return
+            self.close_game(selector, game)
 
     def parse_arguments(self):
         """
         Parses the command line arguments passed to the program on initiation, reporting
-        incorrect usage.
-        N.B. Will exit if an incorrect number of arguments or an invalid port is provided.
-        :return: a single integer representing the port number to be used.
+        incorrect usage. Optional settings are given after the port in the form --name=value.
+        N.B. Will exit if an incorrect number of arguments or an invalid port or option is provided.
+        :return: a tuple of the port number (int) and options {string: int} to be used.
         """
+        arguments = [argument for argument in argv[1:] if not argument.startswith('--')]
         # Check the number of command line arguments
-        if len(argv) not in [1, 2]:  # Can accept 0 or 1 arguments.
+        if len(arguments) not in [0, 1]:  # Can accept 0 or 1 positional arguments.
             print('Client startup failed!\n'
                   'Incorrect number of arguments\n'
-                  'Usage: python jumble-server.py [port]')
+                  'Usage: python jumble-server.py [port] [options...]')
             exit(1)
         port = DEFAULT_PORT  # Default to port 80 (HTTP) if no port is provided.
-        if len(argv) == 2:  # Port has been given, try to parse.
+        if len(arguments) == 1:  # Port has been given, try to parse.
             try:
-                port = int(argv[2])
+                port = int(arguments[0])
                 if port < 5000 or port > 65535:  # Check port is in acceptable range.
                     print('Client startup failed!\n'
                           'Port must be >5000 to avoid clashes with critical ports')
                     exit(2)
-            except TypeError:
+            except ValueError:
                 print('Client startup failed!\n'
                       'Port provided was not an integer!')
-        return port
+                exit(3)
+        options = dict(DEFAULT_OPTIONS)
+        for argument in argv[1:]:
+            if not argument.startswith('--'):
+                continue
+            name, _, value = argument[2:].partition('=')
+            try:
+                if name not in options:
+                    raise ValueError(name)
+                options[name] = type(DEFAULT_OPTIONS[name])(value)
+                if name in CHOICES:
+                    if value not in CHOICES[name]:
+                        raise ValueError(value)
+                elif options[name] < (0 if name in FLAG_OPTIONS else 1):
+                    raise ValueError(value)
+            except ValueError:
+                print('Client startup failed!\n'
+                      'Invalid option: ' + argument)
+                exit(4)
+        if self.words.count(options['min-length'], options['max-length'], options['all-words'],
+                            options['unique-only']) == 0:
+            print('Client startup failed!\n'
+                  'No words in the word list match --min-length and --max-length')
+            exit(5)
+        return port, options
 
     def get_word_list(self):
         """
-        Provides the list of words from the given WORD_LIST_FILE as an array.
-        :return: [string, ...] list of strings of words
+        Provides the words from the given WORD_LIST_FILE, indexed for selection. The index is
+        the compiled DICTIONARY_FILE, memory mapped so that starting up does no parsing and
+        every server process (forked or started separately) shares the same pages.
+        :return: a Dictionary of the words.
         """
-        file = open(WORD_LIST_FILE)
-        words = file.readlines()  # Read entire contents to memory (may be slow).
-        file.close()
-        return words
+        return open_dictionary(WORD_LIST_FILE, DICTIONARY_FILE)
 
     def jumble_word(self, word):
         """
@@ -89,75 +383,174 @@ class JumbleServer(object):
         """
         letters = list(word)  # Split into list
         shuffle(letters)  # Randomise
+        while ''.join(letters) == word and len(set(word)) > 1:  # Never deal the answer itself.
+            shuffle(letters)
         jumble = ''
         for letter in letters:  # Turn back into string
             jumble += letter + ' '
         return jumble
 
-    def get_word(self, word_list):
+    def get_word(self, word_list, min_length, max_length):
         """
-        Returns a word from the word list that has length greater than 0 and less than 5.
-        :param word_list: [string, ...] list of strings of words to choose from.
+        Returns a random word from the word list with a length in the given range.
+        :param word_list: the Dictionary of words to choose from.
+        :param min_length: the shortest acceptable word length.
+        :param max_length: the longest acceptable word length.
         :return: a single word (string) from the provided list.
         """
-        word = word_list[randrange(len(self.words))]
-        while len(word) > 5 or len(word) == 0:
-            word = word_list[randrange(0, len(self.words))]
-        return word.strip()
+        return word_list.choose(min_length, max_length, self.options['all-words'],
+                                self.options['unique-only'])
+
+    def parse_start(self, message):
+        """
+        Reads the word length range a game is to be played with from its START message,
+        which is either 'START' (use the server defaults) or 'START <min> <max>'. Ranges
+        with no matching words fall back to the defaults.
+        :param message: the START message received from the client.
+        :return: a tuple of the minimum and maximum word lengths (int).
+        """
+        default = self.options['min-length'], self.options['max-length']
+        parts = message.split()
+        try:
+            lengths = int(parts[1]), int(parts[2])
+        except (IndexError, ValueError):  # Plain START.
+            return default
+        if self.words.count(lengths[0], lengths[1], self.options['all-words'],
+                            self.options['unique-only']) == 0:
+            return default
+        return lengths
 
     def graceful_shutdown(self, signum, frame):
         """
-        Shuts down all extant connections before exiting the server parent process.
+        Shuts down the server on KeyboardInterrupt: no new players are accepted, players who
+        are thinking are disconnected and turns in progress are given up to the drain timeout
+        to finish before the server exits. The event loop engine drains itself (see
+        drain_event_loop), so this only flags the shutdown there.
         :param signum: not used
         :param frame: not used
         :return: None
         """
+        if self.draining:  # Already shutting down, e.g. interrupted by terminal and parent.
+            return
+        self.draining = True
         print('\nReceived interrupt: Shutting down...')
-        for connection in self.connections:  # Attempt to close down connections
+        self.log_handler.flush()
+        for pid in self.worker_processes:  # Pass the interrupt on to the other processes.
             try:
-                connection.close()
-            except Exception:  # Handle connection is already closed (skip).
+                kill(pid, SIGINT)
+            except OSError:  # Already exited.
                 pass
+        if self.options['engine'] == 'async' and self.listening is not None:
+            return
+        if self.listening is not None:
+            self.listening.close()  # Refuse new players.
+        deadline = monotonic() + self.options['drain-timeout']
+        while self.registry and monotonic() < deadline:
+            for connection in self.registry.idle():  # Wakes its worker, which closes it.
+                shutdown_connection(connection)
+            sleep(DRAIN_POLL)
+        self.finish_shutdown()
+
+    def finish_shutdown(self):
+        """
+        Shuts down any connections still open, waits for the other server processes to exit
+        and exits.
+        :return: None
+        """
+        for connection in self.registry.all():
+            shutdown_connection(connection)
+        for pid in self.worker_processes:
+            try:
+                waitpid(pid, 0)
+            except ChildProcessError:  # Already reaped.
+                pass
+        self.log_handler.flush()
         exit(1)
 
     def handle_client(self, connection):
         """
-        This method is provided as the core functionality of each thread created to handle
-        a client. It confirms a connection and then runs the game loop until explicitly
-        interrupted.
+        This method is provided as the core functionality of each pool thread while it
+        hosts a client. It waits for the START message and then runs the game loop until the
+        client leaves, or takes longer than the idle timeout over a message.
         :param connection: the socket connection to the client.
         :return: None
         """
-        while True:  # Loop through received data until there is none left to parse.
-            data = connection.recv(1024).decode()
-            if data == '':
-                connection.close()
-                print('Connection closed.')
-                break
-            reply = 'ACCEPTED'
-            connection.send(reply.encode())  # Send confirmation of receipt.
-            self.game_loop(connection)
+        decoder = FrameDecoder()  # Messages are framed, see protocol.py.
+        connection.settimeout(self.options['idle-timeout'])  # Applies to every recv and send.
+        try:
+            message = self.receive_turn(connection, decoder)
+            if message is not None:
+                self.game_loop(connection, decoder, *self.parse_start(message))
+        except (OSError, ValueError):  # Connection lost or invalid frame.
+            self.log.debug('Client connection lost, shutting down thread...')  # Handle client loss
+        connection.close()
+        self.log.debug('Connection closed.')
 
-    def game_loop(self, connection):
+    def game_loop(self, connection, decoder, min_length, max_length):
         """
-        Provides words and confirmation/correct answers to a client indefinitely until
-        interrupted.
+        Provides words and confirmation/correct answers to a client until it leaves. Each
+        verdict is sent in one write together with the next jumble, so a turn costs the
+        client a single round trip.
         :param connection: the socket connection to the client.
+        :param decoder: the connection's FrameDecoder.
+        :param min_length: the shortest word length to deal in this game.
+        :param max_length: the longest word length to deal in this game.
         :return: None
         """
+        verdict = 'ACCEPTED'  # Confirmation of receipt of START.
+        received = None  # When the guess being answered was received.
         while True:
-            try:
-                word = self.get_word(self.words)  # Get word
-                jumble = self.jumble_word(word)  # Jumble word
-                connection.send(jumble.encode())  # Send word
-                guess = connection.recv(1024).decode()  # Receive guess
-                if guess == word:
-                    connection.send('YES'.encode())  # Send confirmation
-                else:
-                    connection.send(word.encode())  # Send rejection (correct spelling)
-            except BrokenPipeError:
-                print("Client connection lost, shutting down thread...")  # Handle client loss
-                break
+            word = self.get_word(self.words, min_length, max_length)  # Get word
+            jumble = self.jumble_word(word)  # Jumble word
+            frames = encode_messages(verdict, jumble)
+            connection.sendall(frames)  # Send verdict and word
+            self.metrics.add('jumble_sent_bytes_total', len(frames))
+            if received is not None:
+                self.metrics.observe(perf_counter() - received)
+            guess = self.receive_turn(connection, decoder)  # Receive guess
+            if guess is None:  # Client left, or server shutting down.
+                return
+            received = perf_counter()
+            self.metrics.add('jumble_rounds_total')
+            if self.words.is_anagram(guess.strip(), word):  # Any dictionary anagram is correct.
+                self.metrics.add('jumble_rounds_won_total')
+                verdict = 'YES'  # Confirmation
+            else:
+                verdict = word  # Rejection (correct spelling)
+
+    def receive_turn(self, connection, decoder):
+        """
+        Waits for a player's next message, marking the connection idle meanwhile so shutdown
+        may close it.
+        :param connection: the socket connection to the client.
+        :param decoder: the connection's FrameDecoder.
+        :return: the message (string), or None if the player left or the server is shutting down.
+        """
+        self.registry.set_idle(connection, True)
+        if self.draining:
+            return None
+        message = receive_message(connection, decoder)
+        self.registry.set_idle(connection, False)
+        return message
+
+
+class JumbleGame(object):
+    """
+    The state of one game hosted by the event loop engine, kept in place of a thread stack.
+    """
+    __slots__ = ('connection', 'decoder', 'outbound', 'word', 'min_length', 'max_length',
+                 'rounds', 'wins', 'last_active')
+
+    def __init__(self, connection):
+        self.connection = connection  # Non-blocking player socket.
+        self.decoder = FrameDecoder()  # Messages received but not yet handled.
+        self.outbound = b''  # Reply bytes not yet accepted by the kernel.
+        self.word = None  # Word currently jumbled, None until the START message.
+        self.min_length = 0  # Word length range chosen by START.
+        self.max_length = 0
+        self.rounds = 0  # Guesses made.
+        self.wins = 0  # Correct guesses made.
+        self.last_active = 0.0  # Monotonic time of the last activity, for idle expiry.
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+"""
+Author: Nicholas Lambourne
+CSE 3300  - Computer Networks and Data Communication
+Professor: Dr Bing Wang
+Assignment 1: Jumble Protocol
+
+Framing shared by the jumble client and server. TCP is a byte stream, so one send may be
+received in pieces or together with the next, and messages cannot be told apart by recv
+calls. Each message is therefore sent as a frame: its length in bytes (2 bytes, network
+order) followed by that many bytes of UTF-8 text. Frames may be concatenated freely, so a
+verdict and the next jumble (or several messages) go out in a single send.
+"""
+
+from struct import Struct
+
+LENGTH = Struct('!H')  # Frame header, the length of the message that follows.
+MAX_MESSAGE = 1024  # Longest message (bytes) either side will accept.
+RECV_SIZE = 4096  # Most bytes read from the socket at once.
+
+
+def encode_message(message):
+    """
+    Frames a message for sending.
+    N.B. Raises ValueError if the message is longer than MAX_MESSAGE bytes once encoded.
+    :param message: the message (string).
+    :return: the frame (bytes).
+    """
+    payload = message.encode()
+    if len(payload) > MAX_MESSAGE:
+        raise ValueError('Message too long: {} bytes'.format(len(payload)))
+    return LENGTH.pack(len(payload)) + payload
+
+
+def encode_messages(*messages):
+    """
+    Frames several messages to be sent together in one call.
+    :param messages: the messages (strings), in order.
+    :return: the frames back to back (bytes).
+    """
+    return b''.join(encode_message(message) for message in messages)
+
+
+def receive_message(sock, decoder):
+    """
+    Reads the next message from a blocking socket, reading only as much as is needed.
+    N.B. Raises ValueError if the peer sends an invalid frame.
+    :param sock: the connected socket.
+    :param decoder: the socket's FrameDecoder, holding anything already received.
+    :return: the message (string), or None if the connection was closed.
+    """
+    while True:
+        message = decoder.next_message()
+        if message is not None:
+            return message
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            return None
+        decoder.feed(data)
+
+
+class FrameDecoder(object):
+    """
+    Incremental decoder for a stream of frames: bytes are fed in as they arrive, in pieces
+    of any size, and complete messages taken out in order.
+    """
+    __slots__ = ('buffer', 'start')
+
+    def __init__(self):
+        self.buffer = bytearray()  # Received bytes not yet decoded (from start).
+        self.start = 0  # Offset of the first undecoded byte, consumed bytes are dropped lazily.
+
+    def feed(self, data):
+        """
+        Adds received bytes to the stream.
+        :param data: the bytes received.
+        :return: None
+        """
+        if self.start:  # Drop consumed bytes before growing the buffer.
+            del self.buffer[:self.start]
+            self.start = 0
+        self.buffer += data
+
+    def next_message(self):
+        """
+        Takes the next complete message from the stream.
+        N.B. Raises ValueError if the frame is longer than MAX_MESSAGE or not valid UTF-8.
+        :return: the message (string), or None if no complete message has arrived yet.
+        """
+        end = self.start + LENGTH.size
+        if len(self.buffer) < end:
+            return None
+        length, = LENGTH.unpack_from(self.buffer, self.start)
+        if length > MAX_MESSAGE:
+            raise ValueError('Frame too long: {} bytes'.format(length))
+        if len(self.buffer) < end + length:
+            return None
+        self.start = end + length
+        return self.buffer[end:self.start].decode()
@@ -0,0 +1,313 @@
+"""
+Author: Nicholas Lambourne
+CSE 3300  - Computer Networks and Data Communication
+Professor: Dr Bing Wang
+Assignment 1: Server Common
+
+Connection tracking, metrics (and the admin port serving them), logging and process set-up
+shared by the HTTP server and the jumble server, which each add this directory to the module
+search path before importing it.
+"""
+
+from bisect import bisect_left
+from logging import Formatter, Handler
+from mmap import mmap
+from queue import SimpleQueue
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, SHUT_RDWR
+from _thread import start_new_thread, allocate_lock
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(message)s'
+LOG_BATCH = 256  # Most log records written to the terminal at once.
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4'  # Prometheus text exposition format.
+ADMIN_TIMEOUT = 5  # Seconds the admin port waits for a request.
+ADMIN_BACKLOG = 16  # Pending admin connections held by the kernel.
+MAX_ADMIN_REQUEST = 8192  # Most bytes of admin request accepted.
+ADMIN_RECV_SIZE = 4096  # Most bytes of admin request read at once.
+
+
+class ConnectionRegistry(object):
+    """
+    Thread-safe record of the open client connections and whether each is idle (waiting for
+    the client's next request or message, owed nothing), so shutdown can close idle
+    connections straight away and wait for the rest. Connections are removed as they
+    close, so only live ones are ever held.
+    """
+    def __init__(self):
+        self.connections = {}  # Connection -> True if idle.
+        self.lock = allocate_lock()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, connection):
+        """
+        Registers a newly accepted connection, as busy.
+        :param connection: the client socket.
+        :return: None
+        """
+        with self.lock:
+            self.connections[connection] = False
+
+    def set_idle(self, connection, idle):
+        """
+        Records whether a registered connection is idle.
+        :param connection: the client socket.
+        :param idle: True if the connection is idle, otherwise False.
+        :return: None
+        """
+        with self.lock:
+            if connection in self.connections:
+                self.connections[connection] = idle
+
+    def remove(self, connection):
+        """
+        Forgets a closed connection.
+        :param connection: the client socket.
+        :return: None
+        """
+        with self.lock:
+            self.connections.pop(connection, None)
+
+    def idle(self):
+        """
+        :return: [socket, ...] the connections currently idle.
+        """
+        with self.lock:
+            return [connection for connection, idle in self.connections.items() if idle]
+
+    def all(self):
+        """
+        :return: [socket, ...] every open connection.
+        """
+        with self.lock:
+            return list(self.connections)
+
+
+class Metrics(object):
+    """
+    Counters, gauges and a latency histogram held in anonymous shared memory, with a separate
+    slot of values for each server process, so that worker processes forked after it is
+    created all report into it and any process can sum them for the admin port. Updating a
+    value is a lock and an array store, cheap enough to do for every request or turn.
+    """
+    def __init__(self, definitions, histogram, buckets, slots):
+        self.definitions = definitions  # [(name, type, help), ...]
+        self.index = {name: position for position, (name, _, _) in enumerate(definitions)}
+        self.histogram = histogram  # (name, help) of the histogram.
+        self.buckets = buckets  # Upper bounds of the histogram buckets (the last is +Inf).
+        self.width = len(definitions) + len(buckets) + 3  # Values, buckets, +Inf, sum and count.
+        self.slots = slots
+        self.memory = mmap(-1, 8 * self.width * slots)  # Zeroed, shared with forked children.
+        self.values = memoryview(self.memory).cast('d')
+        self.base = 0  # Offset of this process's slot.
+        self.lock = allocate_lock()  # Serialises updates by this process's threads.
+
+    def use_slot(self, slot):
+        """
+        Switches this process to reporting into another slot (called in each forked worker),
+        zeroing its gauges, which belonged to any previous worker in the slot.
+        :param slot: the slot number.
+        :return: None
+        """
+        self.base = slot * self.width
+        for position, (_, kind, _) in enumerate(self.definitions):
+            if kind == 'gauge':
+                self.values[self.base + position] = 0
+
+    def add(self, name, amount=1):
+        """
+        Adds to a counter or gauge.
+        :param name: the name of the value.
+        :param amount: the amount to add (negative to decrease a gauge).
+        :return: None
+        """
+        position = self.base + self.index[name]
+        with self.lock:
+            self.values[position] += amount
+
+    def set(self, name, value):
+        """
+        Sets a gauge.
+        :param name: the name of the value.
+        :param value: its new value.
+        :return: None
+        """
+        self.values[self.base + self.index[name]] = value
+
+    def observe(self, seconds):
+        """
+        Records a latency in the histogram.
+        :param seconds: the latency.
+        :return: None
+        """
+        bucket = self.base + len(self.definitions) + bisect_left(self.buckets, seconds)
+        total = self.base + self.width - 2
+        with self.lock:
+            self.values[bucket] += 1
+            self.values[total] += seconds
+            self.values[total + 1] += 1
+
+    def render(self):
+        """
+        Provides every value, summed over all slots, in the Prometheus text exposition format.
+        :return: the metrics (string).
+        """
+        totals = [sum(self.values[position::self.width]) for position in range(self.width)]
+        lines = []
+        for position, (name, kind, description) in enumerate(self.definitions):
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, kind),
+                      '{} {}'.format(name, format_number(totals[position]))]
+        name, description = self.histogram
+        lines += ['# HELP {} {}'.format(name, description), '# TYPE {} histogram'.format(name)]
+        cumulative = 0
+        for position, bound in enumerate(self.buckets + ['+Inf']):
+            cumulative += totals[len(self.definitions) + position]
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, format_number(cumulative)))
+        lines += ['{}_sum {}'.format(name, format_number(totals[-2])),
+                  '{}_count {}'.format(name, format_number(totals[-1]))]
+        return '\n'.join(lines) + '\n'
+
+
+class AsyncLogHandler(Handler):
+    """
+    Logging handler which passes records to a writer thread rather than writing them itself,
+    so logging from a serving thread costs a queue put and never waits on the terminal. The
+    writer formats whatever records have built up and writes them in one go.
+    """
+    def __init__(self, stream):
+        Handler.__init__(self)
+        self.setFormatter(Formatter(LOG_FORMAT))
+        self.stream = stream
+        self.records = SimpleQueue()
+
+    def start(self):
+        """
+        Starts the writer thread (again, in a forked child, with a fresh queue).
+        :return: None
+        """
+        self.records = SimpleQueue()
+        start_new_thread(self.run_writer, ())
+
+    def emit(self, record):
+        self.records.put(record)
+
+    def run_writer(self):
+        """
+        Body of the writer thread: writes queued records in batches, forever.
+        :return: None
+        """
+        records = self.records
+        while True:
+            batch = [records.get()]
+            while len(batch) < LOG_BATCH and not records.empty():
+                batch.append(records.get())
+            self.write(batch)
+
+    def write(self, batch):
+        """
+        Writes a batch of records to the stream.
+        :param batch: [logging.LogRecord, ...]
+        :return: None
+        """
+        self.stream.write(''.join(self.format(record) + '\n' for record in batch))
+        self.stream.flush()
+
+    def flush(self):
+        """
+        Writes any records still queued from the calling thread, e.g. before exiting.
+        :return: None
+        """
+        batch = []
+        while not self.records.empty():
+            batch.append(self.records.get())
+        if batch:
+            self.write(batch)
+
+
+def format_number(value):
+    """
+    Formats a metric value exactly, whole numbers without a fractional part.
+    :param value: the value (float).
+    :return: the value as a string.
+    """
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def raise_file_limit():
+    """
+    Raises the soft open file limit to the hard limit so an event loop engine can hold as
+    many simultaneous connections as the system allows.
+    :return: None
+    """
+    try:
+        from resource import getrlimit, setrlimit, RLIMIT_NOFILE
+        soft, hard = getrlimit(RLIMIT_NOFILE)
+        setrlimit(RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):  # Unsupported platform or not permitted.
+        pass
+
+
+def shutdown_connection(connection):
+    """
+    Shuts down both directions of a connection, waking any thread blocked on it.
+    :param connection: the socket to shut down.
+    :return: None
+    """
+    try:
+        connection.shutdown(SHUT_RDWR)
+    except OSError:  # Already closed.
+        pass
+
+
+def serve_metrics(host, port, metrics, log=None):
+    """
+    Starts a thread answering GET /metrics on an admin port with a server's metrics, summed
+    over every process, in the Prometheus text format. Any other request gets a 404.
+    :param host: the address to bind, normally the local host only.
+    :param port: the admin port.
+    :param metrics: the server's Metrics.
+    :param log: a logging.Logger for failed admin requests (at debug), or None.
+    :return: None
+    """
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(ADMIN_BACKLOG)
+    start_new_thread(run_metrics_server, (sock, metrics, log))
+
+
+def run_metrics_server(sock, metrics, log):
+    """
+    Body of the admin thread started by serve_metrics: answers one request per connection,
+    forever.
+    :param sock: the bound and listening admin socket.
+    :param metrics: the server's Metrics.
+    :param log: a logging.Logger for failed admin requests, or None.
+    :return: None
+    """
+    while True:
+        connection, address = sock.accept()
+        try:
+            connection.settimeout(ADMIN_TIMEOUT)
+            request = b''
+            # Read to the end of the headers, so closing does not reset the connection.
+            while b'\n\r\n' not in request and b'\n\n' not in request:
+                if len(request) > MAX_ADMIN_REQUEST:
+                    raise ValueError('Admin request too large')
+                data = connection.recv(ADMIN_RECV_SIZE)
+                if not data:
+                    raise EOFError('Connection closed mid request')
+                request += data
+            parts = request.partition(b'\n')[0].decode('latin-1').split()
+            if len(parts) == 3 and parts[0] == 'GET' and parts[1].partition('?')[0] == '/metrics':
+                status, body = '200 OK', metrics.render().encode()
+            else:
+                status, body = '404 Not Found', b''
+            connection.sendall('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+                               'Connection: close\r\n\r\n'
+                               .format(status, METRICS_CONTENT_TYPE, len(body)).encode() + body)
+        except (OSError, EOFError, ValueError) as error:  # Includes timeouts.
+            if log is not None:
+                log.debug('Admin request from %s failed: %s', address, error)
+        finally:
+            connection.close()
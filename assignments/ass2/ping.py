@@ -8,15 +8,62 @@ The remainder was provided as skeleton code by the course instructors.
 """
 
 from socket import *
+import socket as sockets
 import os
-import sys
 import struct
 import time
 import select
-from sys import argv
+from math import sqrt
+from timeit import timeit
+from collections import OrderedDict
+from sys import argv, platform, stdout
 from signal import signal, SIGINT
 
 ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACHABLE = 3
+ICMP_TIME_EXCEEDED = 11
+UNREACHABLE_NOTES = {0: "!N", 1: "!H", 2: "!P", 4: "!F", 13: "!X"}  # By code, as traceroute.
+ICMP_HEADER = struct.Struct("!BBHHH")  # Type, code, checksum, id, sequence (network order).
+TIMESTAMP = struct.Struct("d")  # Echo data, the send time (as sent by sendOnePing).
+PADDING = bytes(range(256))  # Fills the echo data after the timestamp, repeated as needed.
+MAX_SIZE = 65535 - 20 - 8  # Largest echo data that fits in an IP packet.
+RECEIVE_SIZE = 65535  # Large enough for any reply.
+MAX_TTL = 255  # Largest IP time to live, so the most hops a traceroute can probe.
+FLOOD_INTERVAL = 0.01  # Longest gap between probes when flooding (sent at once on a reply).
+LINUX = platform.startswith('linux')
+# Don't fragment options, not exported by every build of the socket module, None if unsupported.
+IP_MTU_DISCOVER = getattr(sockets, 'IP_MTU_DISCOVER', 10 if LINUX else None)  # Linux.
+IP_PMTUDISC_DO = getattr(sockets, 'IP_PMTUDISC_DO', 2)  # The IP_MTU_DISCOVER mode setting DF.
+IP_DONTFRAG = getattr(sockets, 'IP_DONTFRAG', None)  # BSD and macOS.
+# Kernel receive timestamps (Linux), None if unsupported.
+SO_TIMESTAMPNS = getattr(sockets, 'SO_TIMESTAMPNS', 35 if LINUX else None)
+SCM_TIMESTAMPNS = getattr(sockets, 'SCM_TIMESTAMPNS', SO_TIMESTAMPNS)
+TIMESPEC = struct.Struct("@ll")  # A kernel timestamp, seconds and nanoseconds.
+NS = 10 ** 9  # Nanoseconds per second, all times are integer nanoseconds (perf_counter_ns).
+SEQUENCES = 0x10000  # Sequence numbers wrap at 16 bits.
+HISTORY = SEQUENCES // 2  # Answered or expired probes remembered, to recognise stray replies.
+REPLY, OUT_OF_ORDER, DUPLICATE, LATE = "reply", "out of order", "duplicate", "late"
+STATUS_NOTES = {REPLY: "", OUT_OF_ORDER: " (out of order)", DUPLICATE: " (DUP!)",
+                LATE: " (late, counted lost)"}
+SEND_BATCH = 16  # Most probes sent before replies are read again, when catching up.
+RECEIVE_BUFFER = 4 * 1024 * 1024  # Socket receive buffer, so bursts of replies are not dropped.
+DEFAULT_OPTIONS = {
+    'hosts': '',  # File listing further hosts to ping, one per line.
+    'interval': 1.0,  # Seconds between probes to each host, and between reports.
+    'timeout': 1.0,  # Seconds to wait for a reply before counting the probe as lost.
+    'count': 0,  # Probes to send to a single host before stopping, 0 for no limit.
+    'size': 56,  # Bytes of echo data in each probe.
+    'flood': 0,  # 1 to probe a single host as fast as it replies (at least every 10ms).
+    'dont-fragment': 0,  # 1 to forbid fragmentation, so probes larger than the path MTU fail.
+    'benchmark': 0,  # 1 to check and time the checksum functions instead of pinging.
+    'traceroute': 0,  # 1 to trace the route to a single host instead of pinging it.
+    'max-hops': 30,  # Most hops (TTLs) a traceroute probes.
+    'queries': 3,  # Probes a traceroute sends per hop.
+}
+FLAG_OPTIONS = ['flood', 'dont-fragment', 'benchmark', 'traceroute']  # May be given bare, as 1.
+ZERO_OPTIONS = FLAG_OPTIONS + ['count']  # Numeric options which may be 0.
+BENCHMARK_SIZES = [16, 64, 576, 1472, 8972]  # Echo message sizes (bytes), up to jumbo frames.
 
 
 def MyChecksum(hexlist):
@@ -62,35 +109,43 @@ def checksum(string):
     return answer
 
 
-def receiveOnePing(mySocket, ID, timeout, destAddr):
+def internet_checksum(data):
+    """
+    Computes the internet checksum (RFC 1071) of a message without a Python loop per byte or
+    word. Read as one big endian integer, the message is the sum of its 16 bit words times
+    powers of 2**16, and 2**16 is 1 modulo 0xFFFF, so the ones' complement sum of the words is
+    that integer modulo 0xFFFF (with 0xFFFF in place of 0 unless every word is 0). Both steps
+    run in C.
+    :param data: the message (bytes, bytearray or memoryview) with its checksum field zeroed.
+    :return: the checksum (int), to be packed in network order.
+    """
+    value = int.from_bytes(data, "big")
+    if len(data) % 2:  # Odd length, pad with a zero byte.
+        value <<= 8
+    total = value % 0xFFFF
+    if total == 0 and value:
+        total = 0xFFFF
+    return total ^ 0xFFFF
+
+
+def receiveOnePing(mySocket, ID, timeout, destAddr, timeSent):
     timeLeft = timeout
 
     while 1:
-        startedSelect = time.time()
+        startedSelect = time.perf_counter()
         whatReady = select.select([mySocket], [], [], timeLeft)
-        howLongInSelect = (time.time() - startedSelect)
+        howLongInSelect = (time.perf_counter() - startedSelect)
         if whatReady[0] == []:  # Timeout
             return "Request timed out."
 
-        timeReceived = time.time()
-        recPacket, addr = mySocket.recvfrom(1024)
+        recPacket, addr, timeReceived = receive_packet(mySocket)
 
         # Fill in start
 
-        # Calculate where to in the recPacket the ICMP segment will be.
-        header_start_bit = int(160 / 8)  # ICMP packet starts at 160th bit, as per HW sheet - convert to bytes.
-        header_end_bit = header_start_bit + 8  # ICMP packet is 8 bytes long, as per HW sheet.
-
-        # Unpack recPacket, getting header values and data (the sent timestamp).
-        icmp_header_section = recPacket[header_start_bit:header_end_bit]  # Get relevant bits.
-        type, code, checksm, id, sequence = struct.unpack("bbHHh", icmp_header_section)
-        data_size = struct.calcsize("d")  # ICMP data (the timestamp) was encoded as a double.
-        icmp_data_section = recPacket[header_end_bit: header_end_bit + data_size]  # Data is after header.
-        sent_timestamp = struct.unpack("d", icmp_data_section)[0]  # Unpack returns a tuple.
-
-        # Check that the packet is an ICMP reply and is from the host we sent the request to.
-        if type == 0 and code == 0 and id == ID and addr[0] == destAddr:
-            return timeReceived - sent_timestamp  # Return RTT = time_recv - time_sent.
+        # Unpack recPacket, getting header values.
+        reply = parse_echo_reply(recPacket, ID)
+        if reply is not None and addr[0] == destAddr:  # An ICMP reply from the host pinged.
+            return (timeReceived - timeSent) / NS  # Return RTT = time_recv - time_sent.
 
         # Fill in end
 
@@ -99,30 +154,72 @@ def receiveOnePing(mySocket, ID, timeout, destAddr):
             return "Request timed out."
 
 
-def sendOnePing(mySocket, destAddr, ID):
+def parse_echo_reply(packet, ID):
+    """
+    Finds the echo reply to this process's probes in a received packet (IP header included).
+    :param packet: the packet (bytes).
+    :param ID: the identifier this process's probes are sent with.
+    :return: a tuple of the reply's sequence number and the offset of its ICMP header, or None
+    if the packet is not an echo reply with this identifier.
+    """
+    start = (packet[0] & 0x0F) * 4  # The ICMP message follows the IP header (of IHL words).
+    if len(packet) < start + ICMP_HEADER.size + TIMESTAMP.size:
+        return None
+    icmp_type, code, _, id, sequence = ICMP_HEADER.unpack_from(packet, start)
+    if icmp_type != ICMP_ECHO_REPLY or code != 0 or id != ID:
+        return None
+    return sequence, start
+
+
+def parse_icmp_error(packet, ID):
+    """
+    Finds which of this process's probes an ICMP error (time exceeded or destination
+    unreachable) was sent about. The error quotes the IP header and the first 8 bytes (here the
+    ICMP header) of the packet that caused it.
+    :param packet: the packet (bytes, IP header included).
+    :param ID: the identifier this process's probes are sent with.
+    :return: a tuple of the error's type, its code, the probe's sequence number and the
+    probe's destination address (string), or None if the packet is not such an error.
+    """
+    start = (packet[0] & 0x0F) * 4  # The ICMP message follows the IP header (of IHL words).
+    quoted = start + ICMP_HEADER.size  # The quoted IP header follows the error's ICMP header.
+    if len(packet) < quoted + 20 + ICMP_HEADER.size:
+        return None
+    icmp_type, code = packet[start], packet[start + 1]
+    if icmp_type not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+        return None
+    probe = quoted + (packet[quoted] & 0x0F) * 4
+    if packet[quoted + 9] != IPPROTO_ICMP or len(packet) < probe + ICMP_HEADER.size:
+        return None
+    probe_type, _, _, id, sequence = ICMP_HEADER.unpack_from(packet, probe)
+    if probe_type != ICMP_ECHO_REQUEST or id != ID:
+        return None
+    return icmp_type, code, sequence, inet_ntoa(packet[quoted + 16:quoted + 20])
+
+
+def sendOnePing(mySocket, destAddr, ID, sequence=1, size=TIMESTAMP.size):
     # Header is type (8), code (8), checksum (16), id (16), sequence (16)
 
     myChecksum = 0
 
     # Make a dummy header with a 0 checksum
     # struct -- Interpret strings as packed binary data
-    header = struct.pack("bbHHh", ICMP_ECHO_REQUEST, 0, myChecksum, ID, 1)
-    data = struct.pack("d", time.time())
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, myChecksum, ID, sequence)
+    data = TIMESTAMP.pack(time.time())  # Echoed back, but RTTs use the local send time.
+    if size > TIMESTAMP.size:  # Pad the data out to the requested size.
+        data += (PADDING * (size // len(PADDING) + 1))[:size - TIMESTAMP.size]
 
     # Calculate the checksum on the data and the dummy header.
-    # myChecksum = checksum(str(header + data))
-    myChecksum = MyChecksum([i for i in header] + [i for i in data])
-    # Get the right checksum, and put in the header
-    if sys.platform == 'darwin':
-        # Convert 16-bit integers from host to network  byte order
-        myChecksum = htons(myChecksum) & 0xffff
-    else:
-        myChecksum = htons(myChecksum)
+    # The checksum sums network order words, so the result is packed in network order as is.
+    myChecksum = internet_checksum(header + data)
 
-    header = struct.pack("bbHHh", ICMP_ECHO_REQUEST, 0, myChecksum, ID, 1)
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, myChecksum, ID, sequence)
     packet = header + data
 
+    # The send time is kept locally (the echoed timestamp is not trusted), taken last thing.
+    timeSent = time.perf_counter_ns()
     mySocket.sendto(packet, (destAddr, 1))  # AF_INET address must be tuple, not str
+    return timeSent
 
 
 # Both LISTS and TUPLES consist of a number of objects
@@ -136,25 +233,668 @@ def doOnePing(destAddr, timeout):
     mySocket = socket(AF_INET, SOCK_RAW, icmp)
 
     myID = os.getpid() & 0xFFFF  # Return the current process i
-    sendOnePing(mySocket, destAddr, myID)
-    delay = receiveOnePing(mySocket, myID, timeout, destAddr)
+    enable_timestamps(mySocket)
+    timeSent = sendOnePing(mySocket, destAddr, myID)
+    delay = receiveOnePing(mySocket, myID, timeout, destAddr, timeSent)
 
     mySocket.close()
     return delay
 
 
-def ping(host, timeout=1):
+def ping(host, timeout=1, interval=1, count=0, size=TIMESTAMP.size, flood=False,
+         dont_fragment=False):
     # timeout=1 means: If one second goes by without a reply from the server,
     # the client assumes that either the client's ping or the server's pong is lost
     dest = gethostbyname(host)
-    print("Pinging " + dest + " using Python:")
+    print("Pinging {} with {} bytes of data using Python:".format(dest, size))
     print("")
-    # Send ping requests to a server separated by approximately one second
-    while 1:
-        delay = doOnePing(dest, timeout)
-        print(delay)
-        time.sleep(1)  # one second
-    return delay
+    # One socket for the session; every probe takes the next sequence number, so each reply is
+    # matched to its own probe, however late, duplicated or out of order it arrives.
+    mySocket = socket(AF_INET, SOCK_RAW, getprotobyname("icmp"))
+    enable_timestamps(mySocket)
+    if dont_fragment:
+        set_dont_fragment(mySocket)
+    myID = os.getpid() & 0xFFFF
+    stats = HostStats(host, dest)
+    probes = SequenceTable(timeout)
+    if flood:
+        interval = min(interval, FLOOD_INTERVAL)
+    interval = int(interval * NS)
+    start = next_send = time.perf_counter_ns()
+    # Send ping requests to a server separated by the interval, printing replies as they come.
+    # Sends are scheduled on the clock rather than by sleeping, so the interval does not drift.
+    try:
+        while not count or stats.sent < count or probes:
+            now = time.perf_counter_ns()
+            if now >= next_send:
+                sequence = probes.sequence
+                stats.sent += 1
+                try:
+                    sent = sendOnePing(mySocket, dest, myID, sequence, size)
+                except OSError as error:  # e.g. larger than the path MTU, or unreachable.
+                    print("Send failed: seq={} {}".format(sequence, error.strerror))
+                    stats.lost += 1
+                else:
+                    probes.add(dest, sent)
+                    if flood:
+                        stdout.write(".")
+                        stdout.flush()
+                next_send = max(next_send + interval, now)  # Never catch up in a burst.
+                if count and stats.sent == count:
+                    next_send = float("inf")
+            for sequence, _ in probes.expire(now):
+                stats.lost += 1
+                if not flood:
+                    print("Request timed out. seq={}".format(sequence))
+            wake = next_send
+            if probes.next_expiry() is not None:
+                wake = min(wake, probes.next_expiry())
+            elif wake == float("inf"):  # Every probe sent and answered or expired.
+                break
+            if not select.select([mySocket], [], [], max(wake - time.perf_counter_ns(), 0) / NS)[0]:
+                continue
+            recPacket, addr, received = receive_packet(mySocket)
+            reply = parse_echo_reply(recPacket, myID)
+            if reply is None or addr[0] != dest:
+                continue
+            match = probes.reply(reply[0], received)
+            if match is None:
+                continue
+            status, _, rtt = match
+            stats.record(status, rtt)
+            if not flood:
+                print("Reply from {}: bytes={} seq={} time={:.3f} ms{}".format(
+                    dest, len(recPacket) - reply[1], reply[0], 1000 * rtt, STATUS_NOTES[status]))
+            elif status in (REPLY, OUT_OF_ORDER):
+                stdout.write("\b")  # Rub out the probe's dot, those left were lost.
+                stdout.flush()
+                if not probes and next_send != float("inf"):
+                    next_send = received  # All answered, send the next at once.
+    except KeyboardInterrupt:
+        pass
+    if flood:
+        print("")
+    print(stats.statistics((time.perf_counter_ns() - start) / NS))
+    mySocket.close()
+    return stats.replies
+
+
+def traceroute(host, max_hops=30, timeout=1, queries=3, size=TIMESTAMP.size):
+    """
+    Traces the route to a host. Rather than probing one hop at a time, echo requests for every
+    TTL (queries of each) are sent at once, each with its own sequence number. Each router
+    answers the probes whose TTL runs out there with a time exceeded error quoting the probe,
+    and the host answers with echo replies, so the whole path is found in about one round trip
+    (or the timeout, for hops that never answer).
+    :param host: the host to trace the route to.
+    :param max_hops: the largest TTL probed.
+    :param timeout: seconds to wait for the answers.
+    :param queries: probes sent for each TTL.
+    :param size: bytes of echo data in each probe.
+    :return: True if the host was reached, otherwise False.
+    """
+    dest = gethostbyname(host)
+    print("Tracing route to {} ({}), {} hops max, using Python:".format(host, dest, max_hops))
+    print("")
+    mySocket = socket(AF_INET, SOCK_RAW, getprotobyname("icmp"))
+    enable_timestamps(mySocket)
+    try:  # Every probe is sent at once, so the answers can arrive in a burst.
+        mySocket.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)
+    except OSError:  # Not permitted, keep the default.
+        pass
+    myID = os.getpid() & 0xFFFF
+    probes = SequenceTable(timeout)  # Keyed by (TTL, query).
+    for query in range(queries):
+        for ttl in range(1, max_hops + 1):
+            try:
+                mySocket.setsockopt(IPPROTO_IP, IP_TTL, ttl)
+                sent = sendOnePing(mySocket, dest, myID, probes.sequence, size)
+            except OSError as error:  # e.g. larger than the path MTU, shown as * below.
+                print("Send failed: ttl={} query={} {}".format(ttl, query + 1, error.strerror))
+            else:
+                probes.add((ttl, query), sent)
+    answers = {}  # (TTL, query) -> (address, round trip time, note).
+    last = max_hops  # TTL of the last hop, once the host (or an unreachable error) answers.
+    start = time.perf_counter_ns()
+    while any(ttl <= last for ttl, _ in probes.pending()):  # Later probes are not needed.
+        wake = probes.next_expiry()
+        if select.select([mySocket], [], [], max(wake - time.perf_counter_ns(), 0) / NS)[0]:
+            recPacket, addr, received = receive_packet(mySocket)
+            reply = parse_echo_reply(recPacket, myID)
+            if reply is not None and addr[0] == dest:
+                sequence, note = reply[0], ""
+            else:
+                error = parse_icmp_error(recPacket, myID)
+                if error is None or error[3] != dest:
+                    continue
+                sequence = error[2]
+                note = ""
+                if error[0] == ICMP_DEST_UNREACHABLE and error[1] != 3:  # Not port unreachable.
+                    note = " " + UNREACHABLE_NOTES.get(error[1], "!{}".format(error[1]))
+            match = probes.reply(sequence, received)
+            if match is not None and match[0] in (REPLY, OUT_OF_ORDER):
+                answers[match[1]] = (addr[0], match[2], note)
+                if not note and addr[0] != dest:
+                    continue
+                last = min(last, match[1][0])  # The path ends here.
+        probes.expire(time.perf_counter_ns())
+    elapsed = (time.perf_counter_ns() - start) / NS
+    for ttl in range(1, last + 1):
+        line, address = "{:>2} ".format(ttl), None
+        for query in range(queries):
+            answer = answers.get((ttl, query))
+            if answer is None:
+                line += " *"
+                continue
+            if answer[0] != address:  # Print the router's address wherever it changes.
+                address = answer[0]
+                line += "  " + address
+            line += "  {:.3f} ms{}".format(1000 * answer[1], answer[2])
+        print(line)
+    mySocket.close()
+    reached = any(answer[0] == dest and not answer[2] for answer in answers.values())
+    print("")
+    if reached:
+        print("Reached {} in {} hops, {:.3f}s.".format(dest, last, elapsed))
+    else:
+        print("Did not reach {}, {:.3f}s.".format(dest, elapsed))
+    return reached
+
+
+def set_dont_fragment(sock):
+    """
+    Sets the don't fragment flag on a socket's packets, so that a probe larger than the path
+    MTU fails rather than being fragmented.
+    N.B. Will exit if the platform has no way to set it.
+    :param sock: the raw socket.
+    :return: None
+    """
+    if IP_MTU_DISCOVER is None and IP_DONTFRAG is None:
+        print("--dont-fragment is not supported on this platform.")
+        exit(1)
+    try:
+        if IP_MTU_DISCOVER is not None:
+            sock.setsockopt(IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        else:
+            sock.setsockopt(IPPROTO_IP, IP_DONTFRAG, 1)
+    except OSError as error:
+        print("--dont-fragment could not be set: " + error.strerror)
+        exit(1)
+
+
+def enable_timestamps(sock):
+    """
+    Asks the kernel to timestamp the packets a socket receives (SO_TIMESTAMPNS, Linux), so
+    round trip times exclude any delay before the process gets to read them.
+    :param sock: the raw socket.
+    :return: True if enabled, False if unsupported (receive times are then taken on reading).
+    """
+    if SO_TIMESTAMPNS is None or not hasattr(sock, "recvmsg"):
+        return False
+    try:
+        sock.setsockopt(SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+
+def receive_packet(sock):
+    """
+    Reads a packet, with the time it was received: the kernel's timestamp if enabled (see
+    enable_timestamps), otherwise the time it is read.
+    :param sock: the raw socket.
+    :return: a tuple of the packet (bytes), the sender's address and the receive time
+    (perf_counter_ns).
+    """
+    if not hasattr(sock, "recvmsg"):
+        packet, address = sock.recvfrom(RECEIVE_SIZE)
+        return packet, address, time.perf_counter_ns()
+    packet, ancillary, _, address = sock.recvmsg(RECEIVE_SIZE, CMSG_SPACE(TIMESPEC.size))
+    received = time.perf_counter_ns()
+    for level, kind, data in ancillary:
+        if level == SOL_SOCKET and kind == SCM_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            # The stamp is wall clock time, moved onto perf_counter_ns by the clocks' offset.
+            stamped = seconds * NS + nanoseconds - (time.time_ns() - time.perf_counter_ns())
+            if 0 <= received - stamped < NS:  # Otherwise the wall clock was stepped, ignore it.
+                received = stamped
+    return packet, address, received
+
+
+class SequenceTable(object):
+    """
+    The probes of a ping session, keyed by sequence number. Send times are held here rather
+    than read back from the echoed data. Probes are remembered for a while after they are
+    answered or expire, so every reply is matched to the probe it answers and classed as a
+    reply (perhaps out of order, i.e. after a later probe's), late (after its probe was counted
+    lost) or a duplicate.
+    """
+    def __init__(self, timeout):
+        """
+        :param timeout: seconds to wait for a reply before a probe is counted as lost.
+        """
+        self.timeout = int(timeout * NS)
+        self.sequence = 0  # Sequence number of the next probe.
+        self.serial = 0  # Probes sent, orders probes across sequence number wrap around.
+        self.outstanding = OrderedDict()  # Sequence -> (key, send time, serial), oldest first.
+        self.resolved = OrderedDict()  # Sequence -> [key, send time, answered], oldest first.
+        self.latest = {}  # Key -> serial of its most recently sent probe yet answered.
+        self.overdue = []  # [(sequence, key), ...] expired early by sequence number reuse.
+
+    def __len__(self):
+        return len(self.outstanding)
+
+    def add(self, key, sent):
+        """
+        Records a probe just sent with the next sequence number (self.sequence).
+        :param key: what was probed (e.g. an address), given back with the probe's replies.
+        :param sent: the send time (perf_counter_ns).
+        :return: None
+        """
+        sequence = self.sequence
+        stale = self.outstanding.pop(sequence, None)
+        if stale is not None:  # Sequence numbers wrapped before it expired, it is lost.
+            self.overdue.append((sequence, stale[0]))
+        self.resolved.pop(sequence, None)
+        self.outstanding[sequence] = (key, sent, self.serial)
+        self.sequence = (sequence + 1) % SEQUENCES
+        self.serial += 1
+
+    def key(self, sequence):
+        """
+        :param sequence: a sequence number.
+        :return: the key of the probe recently sent with the sequence number, or None.
+        """
+        probe = self.outstanding.get(sequence) or self.resolved.get(sequence)
+        return probe[0] if probe is not None else None
+
+    def reply(self, sequence, received):
+        """
+        Matches a reply to its probe.
+        :param sequence: the reply's sequence number.
+        :param received: the receive time (perf_counter_ns).
+        :return: a tuple of the reply's status (REPLY, OUT_OF_ORDER, DUPLICATE or LATE), the
+        probe's key and the round trip time (seconds), or None if no recent probe matches.
+        """
+        probe = self.outstanding.pop(sequence, None)
+        if probe is not None:
+            key, sent, serial = probe
+            self.remember(sequence, key, sent, True)
+            if serial < self.latest.get(key, -1):
+                return OUT_OF_ORDER, key, (received - sent) / NS
+            self.latest[key] = serial
+            return REPLY, key, (received - sent) / NS
+        probe = self.resolved.get(sequence)
+        if probe is None:
+            return None
+        key, sent, answered = probe
+        if answered:
+            return DUPLICATE, key, (received - sent) / NS
+        probe[2] = True  # Any further copies are duplicates.
+        return LATE, key, (received - sent) / NS
+
+    def expire(self, now):
+        """
+        Expires the probes that have waited longer than the timeout.
+        :param now: the current time (perf_counter_ns).
+        :return: [(sequence, key), ...] the probes now counted as lost.
+        """
+        expired, self.overdue = self.overdue, []
+        while self.outstanding:
+            sequence, (key, sent, _) = next(iter(self.outstanding.items()))
+            if sent + self.timeout > now:
+                break
+            del self.outstanding[sequence]
+            self.remember(sequence, key, sent, False)
+            expired.append((sequence, key))
+        return expired
+
+    def pending(self):
+        """
+        :return: [key, ...] the keys of the outstanding probes, oldest first.
+        """
+        return [probe[0] for probe in self.outstanding.values()]
+
+    def next_expiry(self):
+        """
+        :return: the time (perf_counter_ns) the oldest outstanding probe expires, or None.
+        """
+        if not self.outstanding:
+            return None
+        return next(iter(self.outstanding.values()))[1] + self.timeout
+
+    def remember(self, sequence, key, sent, answered):
+        """
+        Keeps a resolved probe, forgetting the oldest once HISTORY are kept.
+        :return: None
+        """
+        self.resolved[sequence] = [key, sent, answered]
+        if len(self.resolved) > HISTORY:
+            self.resolved.popitem(last=False)
+
+
+class HostStats(object):
+    """
+    A host being pinged and its statistics (for the current interval, if pinged by a
+    MultiPinger).
+    """
+    __slots__ = ('name', 'address', 'sent', 'replies', 'lost', 'late', 'duplicates',
+                 'reordered', 'rtt_total', 'rtt_squares', 'rtt_min', 'rtt_max', 'last_rtt',
+                 'jitter')
+
+    def __init__(self, name, address):
+        self.name = name  # As given by the user.
+        self.address = address  # Resolved IPv4 address (string).
+        self.jitter = 0.0  # Running interarrival jitter estimate (RFC 3550), in seconds.
+        self.last_rtt = None  # Round trip time of the previous reply.
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the interval statistics (jitter is carried over).
+        :return: None
+        """
+        self.sent = 0
+        self.replies = 0
+        self.lost = 0
+        self.late = 0  # Replies after their probe was counted lost.
+        self.duplicates = 0
+        self.reordered = 0  # Replies overtaken by the reply to a later probe.
+        self.rtt_total = 0.0
+        self.rtt_squares = 0.0  # Sum of the squared round trip times, for the deviation.
+        self.rtt_min = None
+        self.rtt_max = 0.0
+
+    def record_reply(self, rtt):
+        """
+        Records a reply to one of the host's probes.
+        :param rtt: the round trip time in seconds.
+        :return: None
+        """
+        self.replies += 1
+        self.rtt_total += rtt
+        self.rtt_squares += rtt * rtt
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_max = max(self.rtt_max, rtt)
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+
+    def record(self, status, rtt):
+        """
+        Records a reply matched by a SequenceTable.
+        :param status: the reply's status (REPLY, OUT_OF_ORDER, DUPLICATE or LATE).
+        :param rtt: the round trip time in seconds.
+        :return: None
+        """
+        if status == DUPLICATE:
+            self.duplicates += 1
+        elif status == LATE:
+            self.late += 1
+        else:
+            if status == OUT_OF_ORDER:
+                self.reordered += 1
+            self.record_reply(rtt)
+
+    def summary(self):
+        """
+        :return: a line (string) describing the host's interval statistics.
+        """
+        resolved = self.replies + self.lost
+        loss = 100.0 * self.lost / resolved if resolved else 0.0
+        if not self.replies:
+            line = "{:<24} sent {:<4} no replies        loss {:5.1f}%".format(
+                self.name, self.sent, loss)
+        else:
+            line = "{:<24} sent {:<4} rtt {:.3f}/{:.3f}/{:.3f} ms  jitter {:.3f} ms  " \
+                   "loss {:5.1f}%".format(self.name, self.sent, 1000 * self.rtt_min,
+                                          1000 * self.rtt_total / self.replies,
+                                          1000 * self.rtt_max, 1000 * self.jitter, loss)
+        for count, label in ((self.late, "late"), (self.duplicates, "dup"),
+                             (self.reordered, "out of order")):
+            if count:
+                line += "  {} {}".format(count, label)
+        return line
+
+    def statistics(self, elapsed):
+        """
+        :param elapsed: seconds the host was pinged for.
+        :return: a summary (string, several lines) of the host's statistics, as printed by ping
+        on exit. Probes still awaiting a reply count as lost.
+        """
+        loss = 100.0 * (self.sent - self.replies) / self.sent if self.sent else 0.0
+        extras = "".join(", +{} {}".format(count, label) for count, label in (
+            (self.duplicates, "duplicates"), (self.late, "late")) if count)
+        if self.reordered:
+            extras += ", {} out of order".format(self.reordered)
+        lines = ["--- {} ping statistics ---".format(self.name),
+                 "{} packets transmitted, {} received{}, {:.1f}% packet loss, time {:.0f}ms".format(
+                     self.sent, self.replies, extras, loss, 1000 * elapsed)]
+        if self.replies:
+            mean = self.rtt_total / self.replies
+            deviation = sqrt(max(self.rtt_squares / self.replies - mean * mean, 0.0))
+            lines.append("rtt min/avg/max/mdev = {:.3f}/{:.3f}/{:.3f}/{:.3f} ms".format(
+                1000 * self.rtt_min, 1000 * mean, 1000 * self.rtt_max, 1000 * deviation))
+        return "\n".join(lines)
+
+
+class MultiPinger(object):
+    """
+    Pings many hosts at once over a single raw socket. Each interval every host is sent one
+    echo request, spread evenly over the interval rather than in one burst. Every probe takes
+    the next sequence number, so replies (from any host, in any order) are matched to their
+    probe by a SequenceTable in a single receive loop. Per host round trip time, jitter, loss
+    and any late, duplicate or out of order replies are reported at the end of every interval.
+    """
+    def __init__(self, hosts, interval, timeout, size):
+        """
+        :param hosts: [HostStats, ...] the hosts to ping.
+        :param interval: seconds between probes to each host, and between reports.
+        :param timeout: seconds to wait for a reply before a probe is counted as lost.
+        :param size: bytes of echo data in each probe.
+        """
+        self.hosts = hosts
+        self.interval = int(interval * NS)
+        self.size = size
+        self.id = os.getpid() & 0xFFFF
+        self.probes = SequenceTable(timeout)  # Keyed by HostStats.
+        self.socket = socket(AF_INET, SOCK_RAW, getprotobyname("icmp"))
+        self.socket.setblocking(False)
+        enable_timestamps(self.socket)
+        try:
+            self.socket.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError:  # Not permitted, keep the default.
+            pass
+
+    def run(self):
+        """
+        Pings the hosts until interrupted.
+        :return: None
+        """
+        spacing = self.interval // len(self.hosts)  # Between consecutive probes.
+        start = time.perf_counter_ns()
+        round_start, index = start, 0  # Start of the current round, next host to probe.
+        next_report = start + self.interval
+        while True:
+            now = time.perf_counter_ns()
+            self.expire_probes(now)
+            if now >= next_report:  # Before sending, so the report never delays a reply.
+                self.report((now - start) / NS)
+                next_report += self.interval
+                now = time.perf_counter_ns()
+            for _ in range(SEND_BATCH):  # Send the probes now due, a batch at a time.
+                if round_start + index * spacing > now:
+                    break
+                if not self.send_probe(self.hosts[index]):
+                    break  # Send buffer full, retry on the next pass.
+                index += 1
+                if index == len(self.hosts):
+                    round_start, index = round_start + self.interval, 0
+            wake = min(round_start + index * spacing, next_report)
+            if self.probes.next_expiry() is not None:
+                wake = min(wake, self.probes.next_expiry())
+            if select.select([self.socket], [], [], max(wake - time.perf_counter_ns(), 0) / NS)[0]:
+                self.receive_replies()
+
+    def send_probe(self, host):
+        """
+        Sends a host its next echo request.
+        :param host: the HostStats to probe.
+        :return: True if sent, False if the socket's send buffer is full.
+        """
+        try:
+            sent = sendOnePing(self.socket, host.address, self.id, self.probes.sequence,
+                               self.size)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:  # e.g. host unreachable, count it as lost.
+            host.sent += 1
+            host.lost += 1
+        else:
+            host.sent += 1
+            self.probes.add(host, sent)
+        return True
+
+    def receive_replies(self):
+        """
+        Reads every packet waiting on the socket, recording replies to outstanding probes.
+        :return: None
+        """
+        while True:
+            try:
+                packet, address, received = receive_packet(self.socket)
+            except (BlockingIOError, InterruptedError):
+                return
+            reply = parse_echo_reply(packet, self.id)
+            if reply is None:  # Not a reply to this process.
+                continue
+            host = self.probes.key(reply[0])
+            if host is None or host.address != address[0]:  # Forgotten, or not from the host.
+                continue
+            status, _, rtt = self.probes.reply(reply[0], received)
+            host.record(status, rtt)
+
+    def expire_probes(self, now):
+        """
+        Counts the probes that have waited longer than the timeout as lost.
+        :param now: the current time (perf_counter_ns).
+        :return: None
+        """
+        for _, host in self.probes.expire(now):
+            host.lost += 1
+
+    def report(self, elapsed):
+        """
+        Prints every host's statistics for the interval just ended, then clears them.
+        :param elapsed: seconds since pinging started.
+        :return: None
+        """
+        sent = sum(host.sent for host in self.hosts)
+        replies = sum(host.replies for host in self.hosts)
+        lost = sum(host.lost for host in self.hosts)
+        lines = ["--- {:.1f}s: {} hosts, {} sent, {} replies, {:.1f}% loss ---".format(
+            elapsed, len(self.hosts), sent, replies,
+            100.0 * lost / (replies + lost) if replies + lost else 0.0)]
+        for host in self.hosts:
+            lines.append(host.summary())
+            host.reset()
+        stdout.write("\n".join(lines) + "\n")
+        stdout.flush()
+
+
+def parse_arguments():
+    """
+    Parses the command line: one or more hosts, then options in the form --name=value.
+    N.B. Will exit if no host or an invalid option is provided.
+    :return: a tuple of the hosts [string, ...] and options {string: value}.
+    """
+    hosts = [argument for argument in argv[1:] if not argument.startswith("--")]
+    options = dict(DEFAULT_OPTIONS)
+    for argument in argv[1:]:
+        if not argument.startswith("--"):
+            continue
+        name, equals, value = argument[2:].partition("=")
+        if not equals and name in FLAG_OPTIONS:
+            value = "1"
+        try:
+            if name not in options:
+                raise ValueError(name)
+            options[name] = type(DEFAULT_OPTIONS[name])(value)
+            if not isinstance(options[name], str) and \
+                    options[name] < (0 if name in ZERO_OPTIONS else 0.001):
+                raise ValueError(value)
+            if name == 'size' and not TIMESTAMP.size <= options[name] <= MAX_SIZE:
+                raise ValueError(value)
+            if name == 'max-hops' and not 1 <= options[name] <= MAX_TTL:
+                raise ValueError(value)
+        except ValueError:
+            print("Invalid option: " + argument)
+            exit(1)
+    if options['hosts']:
+        try:
+            with open(options['hosts']) as file:
+                hosts += [line.strip() for line in file
+                          if line.strip() and not line.startswith("#")]
+        except OSError as error:
+            print("Could not read host list: {}".format(error))
+            exit(1)
+    if not hosts and not options['benchmark']:
+        print("Incorrect number of arguments provided!\n"
+              "Usage: python3 ping <host> [host...] [options...]\n"
+              "N.B: May require admin/sudo privileges.")
+        exit(1)
+    return hosts, options
+
+
+def multi_ping(names, options):
+    """
+    Pings several hosts at once (see MultiPinger) until interrupted.
+    N.B. Will exit if a host cannot be resolved.
+    :param names: [string, ...] the hosts to ping.
+    :param options: {string: value} the parsed options.
+    :return: None
+    """
+    hosts = []
+    for name in names:
+        try:
+            hosts.append(HostStats(name, gethostbyname(name)))
+        except OSError:
+            print("Could not resolve host: " + name)
+            exit(1)
+    print("Pinging {} hosts every {}s using Python:".format(len(hosts), options['interval']))
+    print("")
+    pinger = MultiPinger(hosts, options['interval'], options['timeout'], options['size'])
+    if options['dont-fragment']:
+        set_dont_fragment(pinger.socket)
+    pinger.run()
+
+
+def benchmark():
+    """
+    Checks internet_checksum against MyChecksum on edge cases and random messages, then times
+    both on echo messages of BENCHMARK_SIZES bytes.
+    N.B. Will exit if the checksums ever differ.
+    :return: None
+    """
+    cases = [b"", b"\x00" * 8, b"\xff" * 8, b"\xff\xff\x00\x00", b"\x00\x01" * 0x8000]
+    cases += [os.urandom(2 * length) for length in range(1, 257) for _ in range(8)]
+    cases += [os.urandom(size) for size in BENCHMARK_SIZES]
+    for data in cases:
+        for message in (data, bytearray(data), memoryview(data)):
+            if internet_checksum(message) != MyChecksum(data):
+                print("Checksum mismatch on {} byte message: {!r}".format(len(data), data[:32]))
+                exit(1)
+    print("internet_checksum matches MyChecksum on {} messages.".format(len(cases)))
+    print("")
+    print("{:>6}  {:>14}  {:>20}  {:>8}".format("bytes", "MyChecksum us", "internet_checksum us",
+                                               "speedup"))
+    for size in BENCHMARK_SIZES:
+        data = os.urandom(size)
+        repeats = max(10, 200000 // size)
+        slow = timeit(lambda: MyChecksum(data), number=repeats) / repeats
+        fast = timeit(lambda: internet_checksum(data), number=repeats) / repeats
+        print("{:>6}  {:>14.2f}  {:>20.3f}  {:>7.0f}x".format(size, 1e6 * slow, 1e6 * fast,
+                                                           slow / fast))
 
 
 def shutdown(signum, frame):
@@ -163,11 +903,20 @@ def shutdown(signum, frame):
 
 
 if __name__ == "__main__":
-    # Check that a host (and only one) has been provided.
-    if len(argv) != 2:
-        print("Incorrect number of arguments provided!\n"
-              "Usage: python3 ping <host>\n"
-              "N.B: May require admin/sudo privileges.")
-        exit(1)
-    signal(SIGINT, shutdown)  # Set up KeyboardInterrupt handling.
-    ping(argv[1])
+    hosts, options = parse_arguments()
+    if options['benchmark']:
+        benchmark()
+    elif options['traceroute']:
+        if len(hosts) != 1:
+            print("--traceroute takes a single host.")
+            exit(1)
+        signal(SIGINT, shutdown)  # Set up KeyboardInterrupt handling.
+        exit(0 if traceroute(hosts[0], options['max-hops'], options['timeout'],
+                             options['queries'], options['size']) else 1)
+    elif len(hosts) == 1:  # Interrupting prints the statistics, then exits.
+        replies = ping(hosts[0], options['timeout'], options['interval'], options['count'],
+                       options['size'], options['flood'], options['dont-fragment'])
+        exit(0 if replies else 1)
+    else:  # Several hosts, ping them all at once.
+        signal(SIGINT, shutdown)  # Set up KeyboardInterrupt handling.
+        multi_ping(hosts, options)